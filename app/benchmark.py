@@ -1,9 +1,139 @@
 import time
 import csv
+import json
+import itertools
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+import pyarrow as pa
 import pyarrow.flight as fl
 import pyarrow.parquet as pq
 
+from client import call_options, endpoint_client
+from export import EXPORT_ROW_GROUP_ROWS, ExportWriter
+
+
+def estimate_ipc_bytes(table: pa.Table, compression: str | None = None) -> int:
+    """
+    Estimated Flight payload of `table`: its size re-encoded on the client
+    as an Arrow IPC stream with the given body compression. Not measured
+    traffic: batch boundaries and gRPC framing are not those of the call.
+    """
+    sink = pa.MockOutputStream()
+    options = pa.ipc.IpcWriteOptions(compression=None if compression in (None, "none") else compression)
+    with pa.ipc.new_stream(sink, table.schema, options=options) as writer:
+        writer.write_table(table)
+    return sink.size()
+
+
+def trips_descriptor(
+    columns: list[str] | None = None,
+    where: dict | None = None,
+    start_from: str | None = None,
+    start_to: str | None = None,
+    order_by: list[tuple[str, str]] | None = None,
+    limit: int | None = None,
+) -> fl.FlightDescriptor:
+    """
+    Command descriptor for a trips query the server compiles to SQL: only
+    the requested columns and matching rows cross the wire. where maps
+    company_id / driver_id / vehicle_id / status / start_city / end_city
+    to a value or a list of values; start_from / start_to are ISO times.
+    """
+    command = {"kind": "trips"}
+    for key, value in (
+        ("columns", columns), ("where", where), ("start_from", start_from),
+        ("start_to", start_to), ("order_by", order_by), ("limit", limit),
+    ):
+        if value is not None:
+            command[key] = value
+    return fl.FlightDescriptor.for_command(json.dumps(command).encode())
+
+
+def _read_endpoint(
+    client: fl.FlightClient,
+    endpoint: fl.FlightEndpoint,
+    first_batch_at: list[float],
+    options: fl.FlightCallOptions | None = None,
+) -> pa.Table:
+    reader = endpoint_client(client, endpoint).do_get(endpoint.ticket, options or fl.FlightCallOptions())
+    batches = []
+    while True:
+        try:
+            chunk = reader.read_chunk()
+        except StopIteration:
+            break
+        if chunk.data is None:
+            continue
+        if not batches:
+            first_batch_at.append(time.perf_counter())
+        batches.append(chunk.data)
+    return pa.Table.from_batches(batches, schema=reader.schema)
+
+
+def read_endpoints(
+    client: fl.FlightClient,
+    info: fl.FlightInfo,
+    phases: dict | None = None,
+    options: fl.FlightCallOptions | None = None,
+) -> pa.Table:
+    """
+    Read every endpoint of a FlightInfo and concatenate the results in
+    endpoint order. Partitioned results are fetched concurrently.
+
+    If phases is given it receives ttfb_ms (DoGet issued -> first batch
+    on any endpoint), drain_ms (first batch -> last batch), total_ms and
+    bytes (Arrow buffer bytes received, i.e. the uncompressed IPC body).
+    """
+    endpoints = list(info.endpoints)
+    first_batch_at: list[float] = []
+    start = time.perf_counter()
+
+    if len(endpoints) == 1:
+        table = _read_endpoint(client, endpoints[0], first_batch_at, options)
+    else:
+        with ThreadPoolExecutor(max_workers=len(endpoints)) as pool:
+            tables = list(pool.map(lambda ep: _read_endpoint(client, ep, first_batch_at, options), endpoints))
+        table = pa.concat_tables(tables)
+
+    end = time.perf_counter()
+    if phases is not None:
+        first = min(first_batch_at) if first_batch_at else end
+        phases["ttfb_ms"] = (first - start) * 1000.0
+        phases["drain_ms"] = (end - first) * 1000.0
+        phases["total_ms"] = (end - start) * 1000.0
+        phases["bytes"] = table.nbytes
+    return table
+
+
+def server_phases(client: fl.FlightClient, info: fl.FlightInfo) -> dict:
+    """
+    Fetch the server's phase timings for one FlightInfo (via the timings
+    action) and fold them into one dict: plan_ms, db_ms, arrow_ms,
+    stream_ms (slowest endpoint), cache_hits and codec (the IPC
+    compression the server used, if it reported one).
+    """
+    if not info.app_metadata:
+        return {}
+    request_id = json.loads(info.app_metadata)["request_id"]
+    results = list(client.do_action(fl.Action("timings", request_id.encode())))
+    phases = json.loads(results[0].body.to_pybytes()) if results else []
+
+    out = {"plan_ms": 0.0, "db_ms": 0.0, "arrow_ms": 0.0, "stream_ms": 0.0, "cache_hits": 0}
+    for p in phases:
+        if p.get("codec"):
+            out["codec"] = p["codec"]
+        if p["phase"] == "plan":
+            out["plan_ms"] += p["plan_ms"]
+        elif p.get("cache_hit"):
+            out["cache_hits"] += 1
+        else:
+            out["db_ms"] += p["db_first_ms"] + p["db_fetch_ms"]
+            out["arrow_ms"] += p["arrow_ms"]
+            out["stream_ms"] = max(out["stream_ms"], p["stream_ms"])
+    return out
+
 
 def fetch_once(
     client: fl.FlightClient,
@@ -11,20 +141,30 @@ def fetch_once(
     output_dir: Path,
     parquet_filename: str | None = None,
     write_parquet: bool = False,
-):
+    compression: str | None = None,
+) -> dict:
     """
-    Perform a single Flight do_get call.
-    Optionally write the result to a Parquet file.
+    Perform a single get_flight_info + do_get round, timing each phase
+    with perf_counter. Optionally write the result to a Parquet file.
+    compression (lz4, zstd) asks the server to compress the IPC stream.
 
     Returns:
-        rows (int), duration_ms (float), parquet_bytes (int | None)
+        dict {rows, ms, info_ms, ttfb_ms, drain_ms, bytes, mb_per_s,
+              ipc_bytes_estimate, ipc_estimate_mb_per_s, parquet_bytes, server}
+        where ms is do_get until the stream is drained (as before),
+        ipc_bytes_estimate is estimate_ipc_bytes() with the codec the server
+        used (not measured traffic) and server holds the server-side phases
+        from server_phases().
     """
-    info = client.get_flight_info(descriptor)
+    options = call_options(compression)
+    start = time.perf_counter()
+    info = client.get_flight_info(descriptor, options)
+    info_ms = (time.perf_counter() - start) * 1000.0
 
-    start = time.time()
-    reader = client.do_get(info.endpoints[0].ticket)
-    table = reader.read_all()
-    duration_ms = (time.time() - start) * 1000.0
+    phases: dict = {}
+    table = read_endpoints(client, info, phases, options)
+    server = server_phases(client, info)
+    ipc_bytes = estimate_ipc_bytes(table, server.get("codec", compression))
 
     parquet_bytes = None
     if write_parquet and parquet_filename is not None:
@@ -33,7 +173,79 @@ def fetch_once(
         pq.write_table(table, out_path)
         parquet_bytes = out_path.stat().st_size
 
-    return table.num_rows, duration_ms, parquet_bytes
+    ms = phases["total_ms"]
+    return {
+        "rows": table.num_rows,
+        "ms": ms,
+        "info_ms": info_ms,
+        "ttfb_ms": phases["ttfb_ms"],
+        "drain_ms": phases["drain_ms"],
+        "bytes": phases["bytes"],
+        "mb_per_s": phases["bytes"] / (1024 * 1024) / (ms / 1000.0) if ms > 0 else 0.0,
+        "ipc_bytes_estimate": ipc_bytes,
+        "ipc_estimate_mb_per_s": ipc_bytes / (1024 * 1024) / (ms / 1000.0) if ms > 0 else 0.0,
+        "parquet_bytes": parquet_bytes,
+        "server": server,
+    }
+
+
+def export_flight(
+    client: fl.FlightClient,
+    descriptor: fl.FlightDescriptor,
+    out_path: Path,
+    fmt: str = "parquet",
+    compression: str | None = "zstd",
+    row_group_size: int = EXPORT_ROW_GROUP_ROWS,
+    use_dictionary: bool | list[str] = True,
+    wire_compression: str | None = None,
+) -> dict:
+    """
+    Stream a descriptor's result into a local Parquet / Arrow IPC file
+    (see export.ExportWriter). Endpoints are read one after another in
+    order and each batch is handed to the writer as it arrives, so the
+    full table is never held in memory.
+
+    Returns {rows, row_groups, bytes (file size), ms, ttfb_ms}.
+    """
+    options = call_options(wire_compression)
+    start = time.perf_counter()
+    info = client.get_flight_info(descriptor, options)
+    first_batch_at = None
+
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    readers = (endpoint_client(client, ep).do_get(ep.ticket, options) for ep in info.endpoints)
+    first = next(readers, None)
+    schema = first.schema if first is not None else info.schema
+    with ExportWriter(out_path, schema, fmt, compression, row_group_size, use_dictionary) as writer:
+        for reader in itertools.chain([first] if first is not None else [], readers):
+            for chunk in reader:
+                if first_batch_at is None:
+                    first_batch_at = time.perf_counter()
+                writer.write_batch(chunk.data)
+
+    end = time.perf_counter()
+    return {
+        "rows": writer.rows,
+        "row_groups": writer.row_groups,
+        "bytes": out_path.stat().st_size,
+        "ms": (end - start) * 1000.0,
+        "ttfb_ms": ((first_batch_at or end) - start) * 1000.0,
+    }
+
+
+def export_on_server(client: fl.FlightClient, path: list[str], **options) -> dict:
+    """
+    Ask the server to write a descriptor's result to a file on its side
+    (export action). options: format, file, compression, row_group_size,
+    use_dictionary. Returns the server's {file, format, rows, row_groups, bytes, ms}.
+    """
+    body = json.dumps({"path": path, **options}).encode()
+    results = list(client.do_action(fl.Action("export", body)))
+    return json.loads(results[0].body.to_pybytes())
+
+
+def _avg(values: list[float]) -> float:
+    return sum(values) / len(values) if values else 0.0
 
 
 def benchmark_query(
@@ -45,50 +257,62 @@ def benchmark_query(
     runs: int = 10,
     warmup: int = 1,
     verbose: bool = True,
+    compression: str | None = None,
 ):
     """
     Run a query multiple times, compute timing stats, and write Parquet once.
-    Warmup runs are not included in the stats.
+    Warmup runs are not included in the stats. compression selects the
+    IPC codec the server uses for the stream (None = server default).
 
     Returns:
         dict with stats:
         {label, rows, runs, warmup, avg_ms, min_ms, max_ms, parquet_bytes}
+        plus per-phase averages (see PHASE_COLUMNS)
     """
     if verbose:
         print(f"Benchmarking {label} ({runs} runs, warmup={warmup})...")
 
     # warmup
     for i in range(warmup):
-        rows, dur, _ = fetch_once(client, descriptor, output_dir, write_parquet=False)
+        r = fetch_once(client, descriptor, output_dir, write_parquet=False, compression=compression)
         if verbose:
-            print(f"  warmup {i+1}/{warmup}: {rows} rows in {dur:.1f} ms")
+            print(f"  warmup {i+1}/{warmup}: {r['rows']} rows in {r['ms']:.1f} ms")
 
-    durations = []
+    results = []
     rows_seen = None
     parquet_bytes = None
 
     for i in range(runs):
         write_parquet = (i == 0 and parquet_filename is not None)
-        rows, dur, pb = fetch_once(
+        r = fetch_once(
             client,
             descriptor,
             output_dir,
             parquet_filename=parquet_filename,
             write_parquet=write_parquet,
+            compression=compression,
         )
+        rows = r["rows"]
 
         if rows_seen is None:
             rows_seen = rows
         elif rows_seen != rows and verbose:
             print(f"WARNING: row count changed for {label}: {rows_seen} -> {rows}")
 
-        if parquet_bytes is None and pb is not None:
-            parquet_bytes = pb
+        if parquet_bytes is None and r["parquet_bytes"] is not None:
+            parquet_bytes = r["parquet_bytes"]
 
-        durations.append(dur)
+        results.append(r)
         if verbose:
-            print(f"  run {i+1}/{runs}: {rows} rows in {dur:.1f} ms")
+            srv = r["server"]
+            print(
+                f"  run {i+1}/{runs}: {rows} rows in {r['ms']:.1f} ms "
+                f"(info {r['info_ms']:.1f} | ttfb {r['ttfb_ms']:.1f} | drain {r['drain_ms']:.1f} | "
+                f"{r['mb_per_s']:.1f} MB/s, ipc ~{r['ipc_bytes_estimate'] / 1e6:.1f} MB (est.) | server db {srv.get('db_ms', 0):.1f} "
+                f"arrow {srv.get('arrow_ms', 0):.1f})"
+            )
 
+    durations = [r["ms"] for r in results]
     avg_ms = sum(durations) / len(durations)
     min_ms = min(durations)
     max_ms = max(durations)
@@ -108,16 +332,307 @@ def benchmark_query(
         "min_ms": min_ms,
         "max_ms": max_ms,
         "parquet_bytes": parquet_bytes,
+        "info_ms": _avg([r["info_ms"] for r in results]),
+        "ttfb_ms": _avg([r["ttfb_ms"] for r in results]),
+        "drain_ms": _avg([r["drain_ms"] for r in results]),
+        "bytes": results[-1]["bytes"],
+        "mb_per_s": _avg([r["mb_per_s"] for r in results]),
+        "compression": compression or "",
+        "ipc_bytes_estimate": results[-1]["ipc_bytes_estimate"],
+        "ipc_estimate_mb_per_s": _avg([r["ipc_estimate_mb_per_s"] for r in results]),
+        "server_plan_ms": _avg([r["server"].get("plan_ms", 0.0) for r in results]),
+        "server_db_ms": _avg([r["server"].get("db_ms", 0.0) for r in results]),
+        "server_arrow_ms": _avg([r["server"].get("arrow_ms", 0.0) for r in results]),
+        "server_stream_ms": _avg([r["server"].get("stream_ms", 0.0) for r in results]),
+    }
+
+
+def fetch_user_histories(
+    client: fl.FlightClient,
+    user_ids: list[int],
+    limits: list[int | None] | None = None,
+    default_limit: int | None = None,
+    batch_size: int = 1000,
+    compression: str | None = None,
+) -> pa.Table:
+    """
+    History of many users in one DoExchange round trip
+    (user_history_batch) instead of one get_flight_info + do_get per
+    user. Returns user_history rows tagged with user_id, in input order.
+    The ids are written on a separate thread so that a large answer
+    cannot block the upload.
+    """
+    path = [b"user_history_batch"]
+    if default_limit is not None:
+        path.append(str(default_limit).encode())
+    writer, reader = client.do_exchange(fl.FlightDescriptor.for_path(*path), call_options(compression))
+
+    columns = {"user_id": pa.array(user_ids, type=pa.int64())}
+    if limits is not None:
+        columns["limit"] = pa.array(limits, type=pa.int64())
+    ids = pa.table(columns)
+
+    def upload():
+        writer.begin(ids.schema)
+        for batch in ids.to_batches(max_chunksize=batch_size):
+            writer.write_batch(batch)
+        writer.done_writing()
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        sent = pool.submit(upload)
+        result = reader.read_all()
+        sent.result()
+    writer.close()
+    return result
+
+
+def benchmark_user_history_batch(
+    client: fl.FlightClient,
+    user_ids: list[int],
+    limit: int,
+    verbose: bool = True,
+) -> list[dict]:
+    """
+    Time fetching the history of `user_ids` (limit rows each) as one
+    DoExchange versus one user_history request per user. One cold run each.
+    """
+    label = f"user_history_{len(user_ids)}_users_limit_{limit}"
+    start = time.perf_counter()
+    rows_exchange = fetch_user_histories(client, user_ids, default_limit=limit).num_rows
+    ms_exchange = (time.perf_counter() - start) * 1000.0
+
+    start = time.perf_counter()
+    rows_separate = 0
+    for uid in user_ids:
+        info = client.get_flight_info(fl.FlightDescriptor.for_path(b"user_history", str(uid).encode(), str(limit).encode()))
+        rows_separate += read_endpoints(client, info).num_rows
+    ms_separate = (time.perf_counter() - start) * 1000.0
+
+    if verbose:
+        print(
+            f"==> {label}: exchange {rows_exchange} rows in {ms_exchange:.1f} ms | "
+            f"separate {rows_separate} rows in {ms_separate:.1f} ms\n"
+        )
+
+    return [
+        {
+            "label": f"{label}_{mode}",
+            "rows": rows,
+            "runs": 1,
+            "warmup": 0,
+            "avg_ms": ms,
+            "min_ms": ms,
+            "max_ms": ms,
+            "parquet_bytes": None,
+        }
+        for mode, rows, ms in (("exchange", rows_exchange, ms_exchange), ("separate", rows_separate, ms_separate))
+    ]
+
+
+def benchmark_pages(
+    client: fl.FlightClient,
+    label: str,
+    path: list[bytes],
+    pages: int = 10,
+    verbose: bool = True,
+) -> list[dict]:
+    """
+    Walk a keyset-paginated descriptor (trips_overview_page/...,
+    user_history_page/...) page by page, appending the start_time, trip_id
+    (and participant_id) of the last row received to the path for the next
+    page. One stats row per page, so deep pages can be compared with the
+    first one.
+    """
+    if verbose:
+        print(f"Paging through {label} ({pages} pages)...")
+
+    page_size = int(path[-1])
+    stats = []
+    after: list[bytes] = []
+    for i in range(pages):
+        descriptor = fl.FlightDescriptor.for_path(*path, *after)
+        start = time.perf_counter()
+        info = client.get_flight_info(descriptor)
+        table = read_endpoints(client, info)
+        ms = (time.perf_counter() - start) * 1000.0
+
+        if verbose:
+            print(f"  page {i+1}/{pages}: {table.num_rows} rows in {ms:.1f} ms")
+        stats.append({
+            "label": f"{label}_page_{i+1}",
+            "rows": table.num_rows,
+            "runs": 1,
+            "warmup": 0,
+            "avg_ms": ms,
+            "min_ms": ms,
+            "max_ms": ms,
+            "parquet_bytes": None,
+        })
+
+        # A short page is the last one.
+        if table.num_rows < page_size:
+            break
+        last = table.num_rows - 1
+        after = [table.column("start_time")[last].as_py().isoformat().encode()]
+        after += [
+            str(table.column(name)[last].as_py()).encode()
+            for name in ("trip_id", "participant_id")
+            if name in table.column_names
+        ]
+
+    if verbose:
+        print()
+    return stats
+
+
+def _percentile(sorted_values: list[float], p: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(-(-p * len(sorted_values) // 100)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def _load_stats(label: str, samples: list[tuple[float, int]], errors: int, elapsed_s: float, clients: int) -> dict:
+    durations = sorted(ms for ms, _ in samples)
+    rows = [r for _, r in samples]
+    return {
+        "label": label,
+        "rows": max(rows) if rows else 0,
+        "runs": len(samples),
+        "warmup": 0,
+        "avg_ms": sum(durations) / len(durations) if durations else 0.0,
+        "min_ms": durations[0] if durations else 0.0,
+        "max_ms": durations[-1] if durations else 0.0,
+        "parquet_bytes": None,
+        "mode": "load",
+        "clients": clients,
+        "qps": len(samples) / elapsed_s if elapsed_s > 0 else 0.0,
+        "p50_ms": _percentile(durations, 50),
+        "p90_ms": _percentile(durations, 90),
+        "p99_ms": _percentile(durations, 99),
+        "p999_ms": _percentile(durations, 99.9),
+        "errors": errors,
+        "rows_per_s": sum(rows) / elapsed_s if elapsed_s > 0 else 0.0,
     }
 
 
+def load_test(
+    uri: str,
+    suite: list[dict],
+    clients: int = 8,
+    duration_s: float | None = 30.0,
+    requests: int | None = None,
+    verbose: bool = True,
+    seed: int = 0,
+):
+    """
+    Run a weighted mix of suite descriptors from `clients` concurrent
+    clients (one thread and one FlightClient each) until duration_s has
+    passed or `requests` requests have been issued in total.
+    Suite items may carry a "weight" (default 1).
+
+    Returns:
+        list of stats dicts, one per label plus an "ALL" row, with the
+        benchmark_query columns plus
+        {mode, clients, qps, p50_ms, p90_ms, p99_ms, p999_ms, errors, rows_per_s}
+    """
+    if duration_s is None and requests is None:
+        raise ValueError("load_test needs duration_s or requests")
+
+    weights = [item.get("weight", 1.0) for item in suite]
+    samples: dict[str, list[tuple[float, int]]] = {item["label"]: [] for item in suite}
+    errors: dict[str, int] = {item["label"]: 0 for item in suite}
+    lock = threading.Lock()
+    issued = 0
+
+    if verbose:
+        limit = f"{duration_s:.0f} s" if duration_s is not None else f"{requests} requests"
+        print(f"Load test: {clients} clients, {limit}, {len(suite)} descriptors...")
+
+    start = time.perf_counter()
+    deadline = start + duration_s if duration_s is not None else None
+
+    def worker(worker_id: int):
+        nonlocal issued
+        client = fl.FlightClient(uri)
+        rng = random.Random(seed + worker_id)
+        while True:
+            with lock:
+                if requests is not None and issued >= requests:
+                    break
+                issued += 1
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+
+            item = rng.choices(suite, weights=weights)[0]
+            t0 = time.perf_counter()
+            try:
+                info = client.get_flight_info(item["descriptor"])
+                rows = read_endpoints(client, info).num_rows
+            except Exception as e:
+                with lock:
+                    errors[item["label"]] += 1
+                if verbose:
+                    print(f"  {item['label']}: {e}")
+                continue
+            ms = (time.perf_counter() - t0) * 1000.0
+            with lock:
+                samples[item["label"]].append((ms, rows))
+        client.close()
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed_s = time.perf_counter() - start
+
+    stats = [
+        _load_stats(f"load_{label}", samples[label], errors[label], elapsed_s, clients)
+        for label in samples
+    ]
+    all_samples = [x for label in samples for x in samples[label]]
+    total = _load_stats("load_ALL", all_samples, sum(errors.values()), elapsed_s, clients)
+    total["rows"] = sum(r for _, r in all_samples)
+    stats.append(total)
+
+    if verbose:
+        for s in stats:
+            print(
+                f"==> {s['label']}: {s['runs']} req | {s['qps']:.1f} qps | "
+                f"p50 {s['p50_ms']:.1f} ms | p90 {s['p90_ms']:.1f} ms | "
+                f"p99 {s['p99_ms']:.1f} ms | p999 {s['p999_ms']:.1f} ms | "
+                f"{s['rows_per_s']:.0f} rows/s | errors {s['errors']}"
+            )
+        print()
+
+    return stats
+
+
+PHASE_COLUMNS = [
+    "info_ms", "ttfb_ms", "drain_ms", "bytes", "mb_per_s",
+    "compression", "ipc_bytes_estimate", "ipc_estimate_mb_per_s",
+    "server_plan_ms", "server_db_ms", "server_arrow_ms", "server_stream_ms",
+]
+LOAD_COLUMNS = ["mode", "clients", "qps", "p50_ms", "p90_ms", "p99_ms", "p999_ms", "errors", "rows_per_s"]
+
+
+def _fmt(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        return f"{value:.3f}"
+    return str(value)
+
+
 def write_stats_csv(output_dir: Path, stats_list, filename: str = "benchmarks.csv"):
     output_dir.mkdir(parents=True, exist_ok=True)
     path = output_dir / filename
 
     with path.open("w", newline="") as f:
         writer = csv.writer(f)
-        writer.writerow(["query_label", "rows", "runs", "warmup", "avg_ms", "min_ms", "max_ms", "parquet_bytes"])
+        writer.writerow(["query_label", "rows", "runs", "warmup", "avg_ms", "min_ms", "max_ms", "parquet_bytes"] + PHASE_COLUMNS + LOAD_COLUMNS)
         for s in stats_list:
             writer.writerow([
                 s["label"],
@@ -128,6 +643,6 @@ def write_stats_csv(output_dir: Path, stats_list, filename: str = "benchmarks.cs
                 f"{s['min_ms']:.3f}",
                 f"{s['max_ms']:.3f}",
                 s["parquet_bytes"] if s["parquet_bytes"] is not None else "",
-            ])
+            ] + [_fmt(s.get(col)) for col in PHASE_COLUMNS + LOAD_COLUMNS])
 
     print(f"Saved benchmark stats to {path}")
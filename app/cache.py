@@ -0,0 +1,193 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable, Iterator
+
+import pyarrow as pa
+
+
+class ResultCache:
+    """
+    In-process cache of Arrow result tables.
+
+    - size-bound: cached tables plus results still being collected never
+      exceed max_bytes (LRU eviction); one result at most max_entry_bytes
+    - per-kind TTL: ttls maps a query kind to seconds (0 = never cached)
+    - invalidation by kind, guarded by a generation counter so a query that
+      started before an invalidation cannot store its (stale) result after it
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        ttls: dict[str, float],
+        default_ttl: float = 0.0,
+        max_entry_bytes: int | None = None,
+    ):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = min(max_bytes, max_entry_bytes or max_bytes)
+        self.ttls = ttls
+        self.default_ttl = default_ttl
+
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[Hashable, tuple[str, pa.Table, float]] = OrderedDict()
+        self._bytes = 0
+        # bytes of batches collect() holds for results not cached yet
+        self._inflight = 0
+        self._generation: dict[str, int] = {}
+
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "puts": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "invalidations": 0,
+            "rejected": 0,
+        }
+
+    def ttl_for(self, kind: str) -> float:
+        return self.ttls.get(kind, self.default_ttl)
+
+    def generation(self, kind: str) -> int:
+        with self._lock:
+            return self._generation.get(kind, 0)
+
+    def get(self, key: Hashable) -> pa.Table | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+
+            kind, table, expires_at = entry
+            if time.monotonic() >= expires_at:
+                self._drop(key)
+                self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return table
+
+    def peek(self, key: Hashable) -> pa.Table | None:
+        """Like get(), but without touching LRU order or hit/miss counters."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() >= entry[2]:
+                return None
+            return entry[1]
+
+    def put(self, key: Hashable, kind: str, table: pa.Table, generation: int) -> bool:
+        ttl = self.ttl_for(kind)
+        nbytes = table.nbytes
+        with self._lock:
+            if ttl <= 0 or nbytes > self.max_entry_bytes or generation != self._generation.get(kind, 0):
+                self._stats["rejected"] += 1
+                return False
+
+            if key in self._entries:
+                self._drop(key)
+            self._evict(nbytes)
+
+            self._entries[key] = (kind, table, time.monotonic() + ttl)
+            self._bytes += nbytes
+            self._stats["puts"] += 1
+            return True
+
+    def collect(
+        self,
+        key: Hashable,
+        kind: str,
+        schema: pa.Schema,
+        batches: Iterator[pa.RecordBatch],
+        generation: int,
+    ) -> Iterator[pa.RecordBatch]:
+        """
+        Pass batches through unchanged and cache the full result once the
+        stream is exhausted. Batches held meanwhile count against max_bytes;
+        caching is given up (streaming goes on) as soon as the result grows
+        past max_entry_bytes or no room is left. generation must be read
+        before the query producing the batches runs (see put()).
+        """
+        if self.ttl_for(kind) <= 0:
+            yield from batches
+            return
+
+        kept: list[pa.RecordBatch] | None = []
+        reserved = 0
+        try:
+            for batch in batches:
+                if kept is not None:
+                    if self._reserve(batch.nbytes, reserved):
+                        reserved += batch.nbytes
+                        kept.append(batch)
+                    else:
+                        kept = None
+                        self._release(reserved)
+                        reserved = 0
+                yield batch
+
+            if kept is not None:
+                table = pa.Table.from_batches(kept, schema=schema)
+                self._release(reserved)
+                reserved = 0
+                self.put(key, kind, table, generation)
+            else:
+                with self._lock:
+                    self._stats["rejected"] += 1
+        finally:
+            # Also reached when the client stops reading early.
+            self._release(reserved)
+
+    def _reserve(self, nbytes: int, held: int) -> bool:
+        """Room for nbytes more of a result that already holds `held` bytes, evicting LRU entries."""
+        with self._lock:
+            if held + nbytes > self.max_entry_bytes:
+                return False
+            self._evict(nbytes)
+            if self._bytes + self._inflight + nbytes > self.max_bytes:
+                return False
+            self._inflight += nbytes
+            return True
+
+    def _release(self, nbytes: int) -> None:
+        if nbytes:
+            with self._lock:
+                self._inflight -= nbytes
+
+    def _evict(self, nbytes: int) -> None:
+        # Caller holds the lock.
+        while self._entries and self._bytes + self._inflight + nbytes > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+            self._stats["evictions"] += 1
+
+    def invalidate(self, kinds) -> int:
+        """Drop every entry of the given kinds. Returns number of dropped entries."""
+        kinds = set(kinds)
+        with self._lock:
+            for kind in kinds:
+                self._generation[kind] = self._generation.get(kind, 0) + 1
+            stale = [k for k, (kind, _, _) in self._entries.items() if kind in kinds]
+            for key in stale:
+                self._drop(key)
+            self._stats["invalidations"] += len(stale)
+            return len(stale)
+
+    def _drop(self, key: Hashable) -> None:
+        _, table, _ = self._entries.pop(key)
+        self._bytes -= table.nbytes
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "hit_ratio": self._stats["hits"] / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "inflight_bytes": self._inflight,
+                "max_bytes": self.max_bytes,
+                "max_entry_bytes": self.max_entry_bytes,
+            }
@@ -0,0 +1,179 @@
+import os
+import threading
+
+import pyarrow as pa
+import psycopg2
+
+from queries import table_row_estimates
+
+CATALOG_REFRESH_S = float(os.environ.get("FLIGHT_CATALOG_REFRESH_S", "60"))
+
+TS = pa.timestamp("us", tz="UTC")
+
+# Result columns are as narrow as their PostgreSQL type (INT / SERIAL ->
+# int32); repetitive text is dictionary-encoded while rows are converted
+# (queries.stream_query(schema=...)). status has a handful of values
+# (validation.TRIP_STATUSES), so int8 indices suffice.
+STATUS = pa.dictionary(pa.int8(), pa.string())
+CATEGORY = pa.dictionary(pa.int32(), pa.string())
+
+TRIPS_OVERVIEW_SCHEMA = pa.schema([
+    ("trip_id", pa.int32()),
+    ("status", STATUS),
+    ("start_time", TS),
+    ("end_time", TS),
+    ("driver_name", pa.string()),
+    ("driver_surname", pa.string()),
+    ("vehicle_id", pa.int32()),
+    ("vehicle_type", CATEGORY),
+    ("vehicle_capacity", pa.int32()),
+    ("start_city", CATEGORY),
+    ("start_street", CATEGORY),
+    ("end_city", CATEGORY),
+    ("end_street", CATEGORY),
+    ("passenger_count", pa.int32()),
+])
+
+USER_HISTORY_SCHEMA = pa.schema([
+    ("trip_id", pa.int32()),
+    ("start_time", TS),
+    ("end_time", TS),
+    ("status", STATUS),
+    ("driver_name", pa.string()),
+    ("driver_surname", pa.string()),
+    ("is_driver", pa.bool_()),
+])
+
+# user_history_page: user_history plus the trip_participant id, which breaks
+# ties between several participations of the user in one trip
+USER_HISTORY_PAGE_SCHEMA = pa.schema(list(USER_HISTORY_SCHEMA) + [("participant_id", pa.int32())])
+
+COMPANY_STATS_SCHEMA = pa.schema([
+    ("day", TS),
+    ("trips", pa.int64()),
+    ("avg_passengers", pa.float64()),
+])
+
+# DoExchange user_history_batch: user_history rows tagged with the user they belong to
+USER_HISTORY_BATCH_SCHEMA = pa.schema([("user_id", pa.int32())] + list(USER_HISTORY_SCHEMA))
+
+# Every column a trips command (queries.TRIPS_COLUMNS) can select
+TRIPS_SCHEMA = pa.schema(
+    list(TRIPS_OVERVIEW_SCHEMA)
+    + [("company_id", pa.int32()), ("driver_id", pa.int32())]
+)
+
+IDS_SCHEMA = pa.schema([("id", pa.int32())])
+
+IDS_ALL_SCHEMA = pa.schema([("pool", CATEGORY), ("id", pa.int32())])
+
+# Flight kind -> (result schema, path arguments after the kind).
+# The schemas are what stream_query produces for the kind's SQL.
+FLIGHT_CATALOG = {
+    "trips_overview": (TRIPS_OVERVIEW_SCHEMA, "[/<limit>]"),
+    "user_history": (USER_HISTORY_SCHEMA, "/<user_id>[/<limit>]"),
+    "company_stats": (COMPANY_STATS_SCHEMA, "/<company_id>[/<limit>]"),
+    "trips_overview_page": (TRIPS_OVERVIEW_SCHEMA, "/<page_size>[/<start_time>/<trip_id>]"),
+    "user_history_page": (
+        USER_HISTORY_PAGE_SCHEMA,
+        "/<user_id>/<page_size>[/<start_time>/<trip_id>/<participant_id>]",
+    ),
+    "ids_vehicle": (IDS_SCHEMA, "[/<limit>]"),
+    "ids_driver": (IDS_SCHEMA, "[/<limit>]"),
+    "ids_user": (IDS_SCHEMA, "[/<limit>]"),
+    "ids_location_home": (IDS_SCHEMA, "[/<limit>]"),
+    "ids_location_office": (IDS_SCHEMA, "[/<limit>]"),
+    "ids_location_pickup": (IDS_SCHEMA, "[/<limit>]"),
+    "ids_trip": (IDS_SCHEMA, "[/<limit>]"),
+    "ids_all": (IDS_ALL_SCHEMA, "[/<pool_size>]"),
+}
+
+
+def trips_schema(columns: list[str] | None) -> pa.Schema:
+    """Result schema of a trips command selecting `columns` (None: all, in TRIPS_SCHEMA order)."""
+    if columns is None:
+        return TRIPS_SCHEMA
+    return pa.schema([TRIPS_SCHEMA.field(c) for c in columns])
+
+
+ESTIMATE_TABLES = ("trip", "trip_participant", "user", "vehicle", "location", "company", "company_daily_stats")
+
+IDS_DEFAULT_LIMIT = 5000
+
+
+class RowEstimates:
+    """
+    Per-kind row-count estimates for list_flights, derived from the
+    planner statistics in pg_class.reltuples (no query execution) and
+    refreshed by a background thread every refresh_s seconds.
+
+    Estimates are for the kind's default arguments: the full listing for
+    trips_overview, per user / per company averages for user_history and
+    company_stats, the default pool size for ids_*. -1 while unknown.
+    """
+
+    def __init__(self, refresh_s: float = CATALOG_REFRESH_S):
+        self.refresh_s = refresh_s
+        self._lock = threading.Lock()
+        self._estimates: dict[str, int] = {}
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def get(self, kind: str) -> int:
+        with self._lock:
+            return self._estimates.get(kind, -1)
+
+    def refresh(self) -> None:
+        tuples = table_row_estimates(ESTIMATE_TABLES)
+        estimates = self._derive(tuples)
+        with self._lock:
+            self._estimates = estimates
+
+    def _run(self) -> None:
+        while True:
+            try:
+                self.refresh()
+            except psycopg2.Error as e:
+                print("Catalog refresh failed:", e)
+            if self._stop.wait(self.refresh_s):
+                return
+
+    @staticmethod
+    def _derive(tuples: dict[str, float]) -> dict[str, int]:
+        def known(*tables):
+            return all(tuples.get(t, -1) >= 0 for t in tables)
+
+        def per(numerator, denominator):
+            if not known(numerator, denominator) or tuples[denominator] < 1:
+                return -1
+            return round(tuples[numerator] / tuples[denominator])
+
+        def capped(table, limit=IDS_DEFAULT_LIMIT):
+            return min(limit, round(tuples[table])) if known(table) else -1
+
+        estimates = {
+            "trips_overview": round(tuples["trip"]) if known("trip") else -1,
+            "user_history": per("trip_participant", "user"),
+            "company_stats": per("company_daily_stats", "company"),
+            "ids_vehicle": capped("vehicle"),
+            "ids_driver": capped("user"),
+            "ids_user": capped("user"),
+            "ids_location_home": capped("location"),
+            "ids_location_office": capped("location"),
+            "ids_location_pickup": capped("location"),
+            "ids_trip": capped("trip"),
+        }
+        estimates["trips_overview_page"] = estimates["trips_overview"]
+        estimates["user_history_page"] = estimates["user_history"]
+        pools = ("ids_vehicle", "ids_driver", "ids_user", "ids_location_home",
+                 "ids_location_office", "ids_location_pickup", "ids_trip")
+        if all(estimates[k] >= 0 for k in pools):
+            estimates["ids_all"] = sum(estimates[k] for k in pools)
+        else:
+            estimates["ids_all"] = -1
+        return estimates
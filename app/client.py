@@ -1,17 +1,49 @@
 import os
+import threading
 from pathlib import Path
 import pyarrow.flight as fl
 
-from benchmark import benchmark_query, write_stats_csv
-from ingest import (
-    do_put_table,
-    fetch_pools,
-    make_trips_table_from_pools,
-    make_trip_participants_table_from_pools,
-)
-
 FLIGHT_URI = os.environ.get("FLIGHT_URI", "grpc://flight-server:8815")
 OUTPUT_DIR = Path("/app/output")
+# ID pools are cached here (Arrow IPC) between runs until the server data changes
+POOL_CACHE_DIR = os.environ.get("POOL_CACHE_DIR", str(OUTPUT_DIR / "cache"))
+
+# Concurrent load test (runs after the serial suite when LOAD_CLIENTS > 0)
+LOAD_CLIENTS = int(os.environ.get("LOAD_CLIENTS", "0"))
+LOAD_DURATION_S = float(os.environ.get("LOAD_DURATION_S", "60"))
+LOAD_REQUESTS = int(os.environ["LOAD_REQUESTS"]) if "LOAD_REQUESTS" in os.environ else None
+
+# IPC compression codecs compared on the largest trips_overview ("" to skip)
+BENCH_CODECS = [c for c in os.environ.get("BENCH_CODECS", "none,lz4,zstd").split(",") if c]
+
+# Request header the server reads the IPC compression codec from
+COMPRESSION_HEADER = b"x-arrow-compression"
+
+
+def call_options(compression: str | None = None) -> fl.FlightCallOptions:
+    """Call options asking the server to compress the IPC stream with `compression` (lz4, zstd)."""
+    if compression is None:
+        return fl.FlightCallOptions()
+    return fl.FlightCallOptions(headers=[(COMPRESSION_HEADER, compression.encode())])
+
+
+_endpoint_clients: dict[str, fl.FlightClient] = {}
+_endpoint_clients_lock = threading.Lock()
+
+
+def endpoint_client(client: fl.FlightClient, endpoint: fl.FlightEndpoint) -> fl.FlightClient:
+    """
+    Client to redeem an endpoint's ticket with: `client` itself if the
+    endpoint has no location (same server), else a shared client for its
+    first location (e.g. a worker process of a multi-process server).
+    """
+    if not endpoint.locations:
+        return client
+    uri = endpoint.locations[0].uri.decode()
+    with _endpoint_clients_lock:
+        if uri not in _endpoint_clients:
+            _endpoint_clients[uri] = fl.FlightClient(uri)
+        return _endpoint_clients[uri]
 
 
 def _as_single_run_stat(label: str, rows: int, ms: float) -> dict:
@@ -29,9 +61,27 @@ def _as_single_run_stat(label: str, rows: int, ms: float) -> dict:
 
 
 def main():
+    # Imported here: benchmark and ingest import the Flight helpers above from this module
+    from benchmark import (
+        benchmark_pages,
+        benchmark_query,
+        benchmark_user_history_batch,
+        export_flight,
+        export_on_server,
+        load_test,
+        trips_descriptor,
+        write_stats_csv,
+    )
+    from ingest import (
+        do_put_table,
+        fetch_pools,
+        make_trips_table_from_pools,
+        make_trip_participants_table_from_pools,
+    )
+
     client = fl.FlightClient(FLIGHT_URI)
 
-    pools = fetch_pools(client, pool_size=5000)
+    pools = fetch_pools(client, pool_size=5000, cache_dir=POOL_CACHE_DIR or None)
 
     stats = []  # <-- now collects both inserts and query benchmarks
 
@@ -77,11 +127,24 @@ def main():
         "label": "trips_overview_limit_100000",
         "descriptor": fl.FlightDescriptor.for_path(b"trips_overview", b"100000"),
         "parquet": "trips_overview_limit_100000.parquet",
+        "weight": 0.1,
     },
     {
         "label": "trips_overview_limit_400000",
         "descriptor": fl.FlightDescriptor.for_path(b"trips_overview", b"400000"),
         "parquet": "trips_overview_limit_400000.parquet",
+        "weight": 0.02,
+    },
+
+    # --- Trips command: 3 columns of one company's completed trips (vs all 14 overview columns)
+    {
+        "label": "trips_cmd_company_1_completed_3_cols_limit_10000",
+        "descriptor": trips_descriptor(
+            columns=["trip_id", "start_time", "passenger_count"],
+            where={"company_id": 1, "status": "COMPLETED"},
+            limit=10000,
+        ),
+        "parquet": "trips_cmd_company_1_completed_3_cols_limit_10000.parquet",
     },
 
     # --- User history
@@ -128,6 +191,51 @@ def main():
             )
         )
 
+    # --- Wire size and throughput per IPC compression codec
+    for codec in BENCH_CODECS:
+        stats.append(
+            benchmark_query(
+                client=client,
+                label=f"trips_overview_limit_400000_{codec}",
+                descriptor=fl.FlightDescriptor.for_path(b"trips_overview", b"400000"),
+                output_dir=OUTPUT_DIR,
+                runs=3,
+                warmup=1,
+                verbose=True,
+                compression=codec,
+            )
+        )
+
+    # --- Keyset pagination: page N should cost the same as page 1
+    stats.extend(benchmark_pages(client, "trips_overview_10000", [b"trips_overview_page", b"10000"], pages=10))
+    stats.extend(benchmark_pages(client, "user_1_history_500", [b"user_history_page", b"1", b"500"], pages=10))
+
+    # --- Team history: one DoExchange vs one request per user
+    stats.extend(benchmark_user_history_batch(client, list(range(1, 201)), limit=20))
+
+    # --- Streaming export of the largest result (client-side file vs server-side export action)
+    exported = export_flight(
+        client,
+        fl.FlightDescriptor.for_path(b"trips_overview", b"400000"),
+        OUTPUT_DIR / "trips_overview_limit_400000_export.parquet",
+    )
+    print(f"Exported trips_overview/400000 on the client: {exported['rows']} rows, {exported['bytes']} bytes in {exported['ms']:.1f} ms")
+    stats.append(_as_single_run_stat("export_client_trips_overview_400000", exported["rows"], exported["ms"]))
+    exported = export_on_server(client, ["trips_overview", "400000"], compression="zstd")
+    print(f"Exported trips_overview/400000 on the server: {exported['rows']} rows, {exported['bytes']} bytes in {exported['ms']:.1f} ms")
+    stats.append(_as_single_run_stat("export_server_trips_overview_400000", exported["rows"], exported["ms"]))
+
+    if LOAD_CLIENTS > 0:
+        stats.extend(
+            load_test(
+                FLIGHT_URI,
+                suite,
+                clients=LOAD_CLIENTS,
+                duration_s=None if LOAD_REQUESTS is not None else LOAD_DURATION_S,
+                requests=LOAD_REQUESTS,
+            )
+        )
+
     write_stats_csv(OUTPUT_DIR, stats, filename="benchmarks_indexed.csv")
 
 
@@ -1,4 +1,5 @@
 -- clean for re-run
+DROP TABLE IF EXISTS company_daily_stats;
 DROP TABLE IF EXISTS trip_participant;
 DROP TABLE IF EXISTS trip;
 DROP TABLE IF EXISTS vehicle;
@@ -0,0 +1,104 @@
+import os
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# parquet: row groups appended as batches arrive; arrow: Arrow IPC file (memory-mappable when uncompressed)
+EXPORT_FORMATS = ("parquet", "arrow")
+EXPORT_ROW_GROUP_ROWS = int(os.environ.get("EXPORT_ROW_GROUP_ROWS", "131072"))
+
+
+class ExportWriter:
+    """
+    Write a stream of RecordBatches to a Parquet or Arrow IPC file as they
+    arrive, so memory stays at about one row group instead of the whole
+    result.
+
+    Parquet: batches are buffered until row_group_size rows, then written
+    as one row group. compression is a Parquet codec (snappy, zstd, lz4,
+    gzip, none); use_dictionary is a bool or a list of column names.
+
+    Arrow: every batch is written to an IPC file as it comes.
+    compression is lz4, zstd or none; an uncompressed file can be read
+    with pa.memory_map without copying. use_dictionary is ignored, and
+    dictionary-encoded columns are stored decoded: every streamed batch
+    brings its own dictionary, which the IPC file format cannot replace.
+    """
+
+    def __init__(
+        self,
+        path,
+        schema: pa.Schema,
+        fmt: str = "parquet",
+        compression: str | None = None,
+        row_group_size: int = EXPORT_ROW_GROUP_ROWS,
+        use_dictionary: bool | list[str] = True,
+    ):
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format {fmt!r}, expected one of {', '.join(EXPORT_FORMATS)}")
+        if row_group_size < 1:
+            raise ValueError("row_group_size must be positive")
+        if compression == "none":
+            compression = None
+
+        self.path = path
+        self.schema = schema
+        self.fmt = fmt
+        self.row_group_size = row_group_size
+        self.rows = 0
+        self.row_groups = 0
+        self._pending: list[pa.RecordBatch] = []
+        self._pending_rows = 0
+
+        if fmt == "parquet":
+            self._writer = pq.ParquetWriter(
+                path,
+                schema,
+                compression=compression or "none",
+                use_dictionary=use_dictionary,
+            )
+        else:
+            self._file_schema = pa.schema([
+                pa.field(f.name, f.type.value_type, f.nullable) if pa.types.is_dictionary(f.type) else f
+                for f in schema
+            ])
+            options = pa.ipc.IpcWriteOptions(compression=compression)
+            self._sink = pa.OSFile(str(path), "wb")
+            self._writer = pa.ipc.new_file(self._sink, self._file_schema, options=options)
+
+    def write_batch(self, batch: pa.RecordBatch) -> None:
+        self.rows += batch.num_rows
+        if self.fmt == "arrow":
+            self._writer.write_batch(batch.cast(self._file_schema))
+            self.row_groups += 1
+            return
+
+        self._pending.append(batch)
+        self._pending_rows += batch.num_rows
+        while self._pending_rows >= self.row_group_size:
+            self._flush(self.row_group_size)
+
+    def _flush(self, rows: int) -> None:
+        table = pa.Table.from_batches(self._pending, schema=self.schema)
+        self._writer.write_table(table.slice(0, rows), row_group_size=rows)
+        self.row_groups += 1
+        rest = table.slice(rows)
+        self._pending = rest.to_batches()
+        self._pending_rows = rest.num_rows
+
+    def close(self) -> int:
+        """Flush the last row group and close the file. Returns the file size in bytes."""
+        if self.fmt == "parquet":
+            if self._pending_rows:
+                self._flush(self._pending_rows)
+            self._writer.close()
+        else:
+            self._writer.close()
+            self._sink.close()
+        return os.path.getsize(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -1,33 +1,82 @@
+import json
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+import numpy as np
 import pyarrow as pa
+import pyarrow.compute as pc
 import pyarrow.flight as fl
-import random
 import datetime
 
+from client import endpoint_client
 
-def _fetch_id_list(client: fl.FlightClient, descriptor: fl.FlightDescriptor) -> list[int]:
-    info = client.get_flight_info(descriptor)
-    reader = client.do_get(info.endpoints[0].ticket)
-    tbl = reader.read_all()
-    if tbl.num_rows == 0:
-        return []
-    return [int(x) for x in tbl.column(0).to_pylist() if x is not None]
-
-
-def fetch_pools(client: fl.FlightClient, pool_size: int = 5000) -> dict:
-    pools = {
-        "vehicle_ids": _fetch_id_list(client, fl.FlightDescriptor.for_path(b"ids_vehicle", str(pool_size).encode())),
-        "driver_ids": _fetch_id_list(client, fl.FlightDescriptor.for_path(b"ids_driver", str(pool_size).encode())),
-        "user_ids": _fetch_id_list(client, fl.FlightDescriptor.for_path(b"ids_user", str(pool_size).encode())),
-        "home_ids": _fetch_id_list(client, fl.FlightDescriptor.for_path(b"ids_location_home", str(pool_size).encode())),
-        "office_ids": _fetch_id_list(client, fl.FlightDescriptor.for_path(b"ids_location_office", str(pool_size).encode())),
-        "pickup_ids": _fetch_id_list(client, fl.FlightDescriptor.for_path(b"ids_location_pickup", str(pool_size).encode())),
-        "trip_ids": _fetch_id_list(client, fl.FlightDescriptor.for_path(b"ids_trip", str(pool_size).encode())),
-    }
+POOL_NAMES = ("vehicle_ids", "driver_ids", "user_ids", "home_ids", "office_ids", "pickup_ids", "trip_ids")
+
+
+def _read_all_endpoints(client: fl.FlightClient, info: fl.FlightInfo) -> pa.Table:
+    tables = [endpoint_client(client, ep).do_get(ep.ticket).read_all() for ep in info.endpoints]
+    return pa.concat_tables(tables) if tables else info.schema.empty_table()
+
+
+def _load_cached_pools(path: Path, data_version: str) -> pa.Table | None:
+    """The cached ids_all table, if present and written for the same data version."""
+    if not path.exists():
+        return None
+    try:
+        with pa.memory_map(str(path)) as source:
+            table = pa.ipc.open_file(source).read_all()
+    except (OSError, pa.ArrowInvalid) as e:
+        print(f"Ignoring unreadable pool cache {path}: {e}")
+        return None
+    cached_version = (table.schema.metadata or {}).get(b"data_version", b"").decode()
+    return table if cached_version == data_version else None
+
+
+def _store_cached_pools(path: Path, table: pa.Table, data_version: str) -> None:
+    # One dictionary per column: the IPC file format cannot replace it between batches.
+    table = table.unify_dictionaries().replace_schema_metadata({"data_version": data_version})
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with pa.OSFile(str(tmp), "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    tmp.replace(path)
+
+
+def fetch_pools(
+    client: fl.FlightClient,
+    pool_size: int = 5000,
+    cache_dir: str | Path | None = None,
+) -> dict[str, np.ndarray]:
+    """
+    All ID pools in one Flight call (ids_all), as int64 NumPy arrays.
+
+    With cache_dir set, the result is kept in an Arrow IPC file and reused
+    across runs for as long as the server reports the same data_version
+    (only get_flight_info is called then; no do_get).
+    """
+    info = client.get_flight_info(fl.FlightDescriptor.for_path(b"ids_all", str(pool_size).encode()))
+    meta = json.loads(info.app_metadata) if info.app_metadata else {}
+    data_version = meta.get("data_version")
+
+    cache_path = Path(cache_dir) / f"ids_all_{pool_size}.arrow" if cache_dir else None
+    table = None
+    if cache_path is not None and data_version is not None:
+        table = _load_cached_pools(cache_path, data_version)
+    if table is None:
+        table = _read_all_endpoints(client, info)
+        if cache_path is not None and data_version is not None:
+            _store_cached_pools(cache_path, table, data_version)
+
+    pool_col = table.column("pool")
+    id_col = table.column("id").cast(pa.int64())
+    pools = {}
+    for name in POOL_NAMES:
+        ids = pc.filter(id_col, pc.equal(pool_col, name)).drop_null()
+        pools[name] = ids.to_numpy()
 
     for k, v in pools.items():
-        if not v:
+        if len(v) == 0:
             raise RuntimeError(f"ID pool '{k}' is empty. Check server endpoint or database data.")
 
     return pools
@@ -37,26 +86,116 @@ def _chunk_table(table: pa.Table, batch_size: int) -> list[pa.RecordBatch]:
     return table.to_batches(max_chunksize=batch_size)
 
 
+def _read_ack(metadata_reader) -> dict | None:
+    buf = metadata_reader.read()
+    return json.loads(buf.to_pybytes()) if buf is not None else None
+
+
 def do_put_table(
     client: fl.FlightClient,
     descriptor: fl.FlightDescriptor,
     table: pa.Table,
     batch_size: int = 5000,
+    max_in_flight: int = 4,
 ) -> dict:
     """
     Send an Arrow table to the Flight server using DoPut.
-    Returns: {rows, batches, ms}
+
+    Waits for the server's per-batch acks so that at most max_in_flight
+    batches are unacknowledged (backpressure), and times until the final
+    ack, i.e. until the rows are committed. Rows the server rejected are
+    reported in rejected_rows / errors ({"row", "column", "error"}, row
+    being the position in `table`).
+    Returns: {rows, batches, committed_rows, rejected_rows, errors, ms}
     """
     batches = _chunk_table(table, batch_size=batch_size)
 
-    start = time.time()
-    writer, _ = client.do_put(descriptor, table.schema)
+    start = time.perf_counter()
+    writer, metadata_reader = client.do_put(descriptor, table.schema)
+    errors = []
+    in_flight = 0
     for b in batches:
         writer.write_batch(b)
+        in_flight += 1
+        while in_flight >= max_in_flight:
+            ack = _read_ack(metadata_reader)
+            if ack is None:
+                break
+            errors.extend(ack.get("errors", []))
+            in_flight -= 1
+    writer.done_writing()
+
+    final = {}
+    while True:
+        ack = _read_ack(metadata_reader)
+        if ack is None or ack.get("done"):
+            final = ack or {}
+            break
+        errors.extend(ack.get("errors", []))
     writer.close()
-    ms = (time.time() - start) * 1000.0
+    ms = (time.perf_counter() - start) * 1000.0
 
-    return {"rows": table.num_rows, "batches": len(batches), "ms": ms}
+    return {
+        "rows": table.num_rows,
+        "batches": len(batches),
+        "committed_rows": final.get("committed_rows", 0),
+        "rejected_rows": final.get("rejected_rows", 0),
+        "errors": errors,
+        "ms": ms,
+    }
+
+
+def bulk_put_table(
+    client: fl.FlightClient,
+    descriptor: fl.FlightDescriptor,
+    table: pa.Table,
+    streams: int = 4,
+    batch_size: int = 5000,
+    max_in_flight: int = 4,
+    commit_each_batch: bool = True,
+) -> dict:
+    """
+    Split a table into `streams` contiguous slices and upload them over
+    concurrent DoPut streams (one server-side connection and transaction
+    each). With commit_each_batch, the server commits every batch, so an
+    interrupted upload keeps what was acknowledged.
+    Returns: {rows, batches, committed_rows, rejected_rows, errors, streams,
+    ms, rows_per_s, mb_per_s}; error rows are positions in `table`.
+    """
+    if commit_each_batch:
+        descriptor = fl.FlightDescriptor.for_path(*descriptor.path, b"batch")
+
+    streams = max(1, min(streams, table.num_rows))
+    size = -(-table.num_rows // streams)
+    slices = [table.slice(i * size, size) for i in range(streams)]
+
+    offsets = [i * size for i in range(streams)]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=streams) as pool:
+        results = list(pool.map(
+            lambda part: do_put_table(client, descriptor, part, batch_size, max_in_flight),
+            slices,
+        ))
+    ms = (time.perf_counter() - start) * 1000.0
+
+    committed = sum(r["committed_rows"] for r in results)
+    errors = [
+        {**e, "row": e["row"] + offset}
+        for r, offset in zip(results, offsets)
+        for e in r["errors"]
+    ]
+    return {
+        "rows": table.num_rows,
+        "batches": sum(r["batches"] for r in results),
+        "committed_rows": committed,
+        "rejected_rows": sum(r["rejected_rows"] for r in results),
+        "errors": errors,
+        "streams": streams,
+        "ms": ms,
+        "rows_per_s": committed / (ms / 1000.0) if ms > 0 else 0.0,
+        "mb_per_s": table.nbytes * committed / max(table.num_rows, 1) / 1e6 / (ms / 1000.0) if ms > 0 else 0.0,
+    }
 
 
 def make_trips_table_from_pools(
@@ -65,6 +204,7 @@ def make_trips_table_from_pools(
     company_id: int = 1,
     status: str = "COMPLETED",
     trip_duration_minutes: int = 20,
+    rng: np.random.Generator | None = None,
 ) -> pa.Table:
     """
     Create an Arrow table for DoPut endpoint: insert_trip
@@ -73,29 +213,28 @@ def make_trips_table_from_pools(
       start_location_id, end_location_id, status
     Uses pools so we don't hardcode IDs.
     """
-    base = datetime.datetime.utcnow().replace(tzinfo=datetime.timezone.utc)
+    rng = rng or np.random.default_rng()
+    base = np.datetime64(datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None), "us")
 
-    vehicle_ids = random.choices(pools["vehicle_ids"], k=n)
-    driver_ids = random.choices(pools["driver_ids"], k=n)
-    company_ids = [company_id] * n
+    vehicle_ids = rng.choice(pools["vehicle_ids"], size=n)
+    driver_ids = rng.choice(pools["driver_ids"], size=n)
 
-    start_candidates = pools["home_ids"] + pools["pickup_ids"]
-    start_loc_ids = random.choices(start_candidates, k=n)
-    end_loc_ids = random.choices(pools["office_ids"], k=n)
+    start_candidates = np.concatenate([pools["home_ids"], pools["pickup_ids"]])
+    start_loc_ids = rng.choice(start_candidates, size=n)
+    end_loc_ids = rng.choice(pools["office_ids"], size=n)
 
-    start_times = [base - datetime.timedelta(minutes=i) for i in range(n)]
-    end_times = [t + datetime.timedelta(minutes=trip_duration_minutes) for t in start_times]
-    statuses = [status] * n
+    start_times = base - np.arange(n) * np.timedelta64(1, "m")
+    end_times = start_times + np.timedelta64(trip_duration_minutes, "m")
 
     return pa.table({
         "vehicle_id": pa.array(vehicle_ids, type=pa.int64()),
         "driver_id": pa.array(driver_ids, type=pa.int64()),
-        "company_id": pa.array(company_ids, type=pa.int64()),
+        "company_id": pa.array(np.full(n, company_id), type=pa.int64()),
         "start_time": pa.array(start_times, type=pa.timestamp("us", tz="UTC")),
         "end_time": pa.array(end_times, type=pa.timestamp("us", tz="UTC")),
         "start_location_id": pa.array(start_loc_ids, type=pa.int64()),
         "end_location_id": pa.array(end_loc_ids, type=pa.int64()),
-        "status": pa.array(statuses, type=pa.string()),
+        "status": pa.repeat(pa.scalar(status, type=pa.string()), n),
     })
 
 
@@ -104,6 +243,7 @@ def make_trip_participants_table_from_pools(
     n: int,
     status: str = "JOINED",
     spread_across_trips: bool = True,
+    rng: np.random.Generator | None = None,
 ) -> pa.Table:
     """
     Create an Arrow table for DoPut endpoint: insert_trip_participant
@@ -112,24 +252,22 @@ def make_trip_participants_table_from_pools(
 
     By default, distributes participants across random trips (spread_across_trips=True).
     """
+    rng = rng or np.random.default_rng()
     if spread_across_trips:
-        trip_ids = random.choices(pools["trip_ids"], k=n)
+        trip_ids = rng.choice(pools["trip_ids"], size=n)
     else:
-        chosen_trip = random.choice(pools["trip_ids"])
-        trip_ids = [chosen_trip] * n
-
-    user_ids = random.choices(pools["user_ids"], k=n)
+        trip_ids = np.full(n, rng.choice(pools["trip_ids"]))
 
-    pickup_candidates = pools["home_ids"] + pools["pickup_ids"]
-    pickup_ids = random.choices(pickup_candidates, k=n)
-    dropoff_ids = random.choices(pools["office_ids"], k=n)
+    user_ids = rng.choice(pools["user_ids"], size=n)
 
-    statuses = [status] * n
+    pickup_candidates = np.concatenate([pools["home_ids"], pools["pickup_ids"]])
+    pickup_ids = rng.choice(pickup_candidates, size=n)
+    dropoff_ids = rng.choice(pools["office_ids"], size=n)
 
     return pa.table({
         "trip_id": pa.array(trip_ids, type=pa.int64()),
         "user_id": pa.array(user_ids, type=pa.int64()),
         "pickup_location_id": pa.array(pickup_ids, type=pa.int64()),
         "dropoff_location_id": pa.array(dropoff_ids, type=pa.int64()),
-        "status": pa.array(statuses, type=pa.string()),
+        "status": pa.repeat(pa.scalar(status, type=pa.string()), n),
     })
@@ -0,0 +1,195 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes available within the checkout timeout."""
+
+
+class ConnectionPool:
+    """
+    Thread-safe psycopg2 connection pool.
+
+    - keeps between minconn and maxconn connections open
+    - blocks (up to timeout seconds) when all connections are in use
+    - health-checks connections on checkout (closed / broken / idle too long)
+    - recycles broken connections and connections older than max_lifetime
+    """
+
+    def __init__(
+        self,
+        dsn: str,
+        minconn: int = 1,
+        maxconn: int = 10,
+        timeout: float = 30.0,
+        check_idle_s: float = 30.0,
+        max_lifetime_s: float = 3600.0,
+        connection_factory=None,
+    ):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError(f"Invalid pool size: min={minconn}, max={maxconn}")
+
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.check_idle_s = check_idle_s
+        self.max_lifetime_s = max_lifetime_s
+        self.connection_factory = connection_factory
+
+        self._cond = threading.Condition()
+        self._idle: list[tuple[psycopg2.extensions.connection, float]] = []  # (conn, returned_at)
+        self._born: dict[int, float] = {}  # id(conn) -> created_at
+        self._size = 0  # open connections + connections being opened
+        self._in_use = 0
+
+        self._stats = {
+            "created": 0,
+            "closed": 0,
+            "checkouts": 0,
+            "timeouts": 0,
+            "health_check_failures": 0,
+            "wait_ms_total": 0.0,
+            "wait_ms_max": 0.0,
+        }
+
+        for _ in range(minconn):
+            self._size += 1
+            self._idle.append((self._connect(), time.monotonic()))
+
+    def _connect(self) -> psycopg2.extensions.connection:
+        try:
+            conn = psycopg2.connect(self.dsn, connection_factory=self.connection_factory)
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._born[id(conn)] = time.monotonic()
+            self._stats["created"] += 1
+        return conn
+
+    def _close(self, conn: psycopg2.extensions.connection) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._born.pop(id(conn), None)
+            self._size -= 1
+            self._stats["closed"] += 1
+            self._cond.notify()
+
+    def _healthy(self, conn: psycopg2.extensions.connection, idle_since: float) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - self._born.get(id(conn), 0.0) > self.max_lifetime_s:
+            return False
+        if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        if time.monotonic() - idle_since < self.check_idle_s:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self) -> psycopg2.extensions.connection:
+        start = time.monotonic()
+        deadline = start + self.timeout
+
+        while True:
+            candidate = None
+            with self._cond:
+                while not self._idle and self._size >= self.maxconn:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeout(f"No DB connection available after {self.timeout:.1f}s")
+                    self._cond.wait(remaining)
+
+                if self._idle:
+                    candidate = self._idle.pop()
+                else:
+                    self._size += 1  # reserve a slot, connect outside the lock
+
+            if candidate is None:
+                conn = self._connect()
+            else:
+                conn, idle_since = candidate
+                if not self._healthy(conn, idle_since):
+                    with self._cond:
+                        self._stats["health_check_failures"] += 1
+                    self._close(conn)
+                    continue
+
+            wait_ms = (time.monotonic() - start) * 1000.0
+            with self._cond:
+                self._in_use += 1
+                self._stats["checkouts"] += 1
+                self._stats["wait_ms_total"] += wait_ms
+                self._stats["wait_ms_max"] = max(self._stats["wait_ms_max"], wait_ms)
+            return conn
+
+    def putconn(self, conn: psycopg2.extensions.connection, discard: bool = False) -> None:
+        with self._cond:
+            self._in_use -= 1
+
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                discard = True
+
+        if discard or conn.closed:
+            self._close(conn)
+            return
+
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """
+        Check out a connection for the duration of a with-block.
+        Uncommitted work is rolled back on return; connections that
+        broke during use are closed instead of going back to the pool.
+        """
+        conn = self.getconn()
+        discard = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            discard = True
+            raise
+        finally:
+            self.putconn(conn, discard=discard)
+
+    def stats(self) -> dict:
+        with self._cond:
+            checkouts = self._stats["checkouts"]
+            return {
+                **self._stats,
+                "wait_ms_avg": self._stats["wait_ms_total"] / checkouts if checkouts else 0.0,
+                "size": self._size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "min": self.minconn,
+                "max": self.maxconn,
+            }
+
+    def close(self) -> None:
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._close(conn)
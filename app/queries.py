@@ -1,29 +1,341 @@
+import hashlib
 import os
+import re
+import select
+import threading
+import time
+import uuid
+from typing import Iterator
 import pyarrow as pa
+import pyarrow.csv as pcsv
 import psycopg2
-from psycopg2.extras import RealDictCursor, execute_values
+import psycopg2.errors
+import psycopg2.extensions
+
+from pool import ConnectionPool
 
 DB_CONN = os.environ.get("DB_CONN", "postgres://demo:demo@db:5432/demo")
+DB_POOL_MIN = int(os.environ.get("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.environ.get("DB_POOL_MAX", "16"))
+DB_POOL_TIMEOUT_S = float(os.environ.get("DB_POOL_TIMEOUT_S", "30"))
+STREAM_CHUNK_ROWS = int(os.environ.get("FLIGHT_STREAM_CHUNK_ROWS", "50000"))
 
 
-def run_query(sql: str, params: dict | None = None) -> pa.Table:
-    conn = psycopg2.connect(DB_CONN)
-    try:
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute(sql, params or {})
-        rows = cur.fetchall()
-    finally:
-        conn.close()
+class PreparingConnection(psycopg2.extensions.connection):
+    """Connection that remembers the statements it has PREPAREd: sql -> (name, param names)."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared: dict[str, tuple[str, tuple[str, ...]]] = {}
+
+
+_pool: ConnectionPool | None = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """Process-wide connection pool, created on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    DB_CONN,
+                    minconn=DB_POOL_MIN,
+                    maxconn=DB_POOL_MAX,
+                    timeout=DB_POOL_TIMEOUT_S,
+                    connection_factory=PreparingConnection,
+                )
+    return _pool
+
+
+def connection():
+    """Context manager that checks a connection out of the process-wide pool."""
+    return get_pool().connection()
+
+
+def pool_stats() -> dict:
+    return get_pool().stats()
+
+
+# LISTEN/NOTIFY channel server processes use to invalidate each other's caches
+INVALIDATE_CHANNEL = "flight_cache_invalidate"
+
+
+def notify_invalidation(cur, kinds) -> None:
+    """Queue an invalidation of `kinds` for every listening process; sent when the transaction commits."""
+    cur.execute("SELECT pg_notify(%s, %s)", (INVALIDATE_CHANNEL, ",".join(kinds)))
+
+
+def listen_invalidations(on_kinds, stop: threading.Event | None = None, retry_s: float = 5.0) -> None:
+    """
+    Block and call on_kinds(kinds) for every invalidation notification,
+    on a dedicated (non-pooled) connection. After each (re)connect,
+    on_kinds(None) is called, since notifications sent while not
+    listening are lost.
+    """
+    while stop is None or not stop.is_set():
+        conn = None
+        try:
+            conn = psycopg2.connect(DB_CONN)
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(f"LISTEN {INVALIDATE_CHANNEL}")
+            on_kinds(None)
+
+            while stop is None or not stop.is_set():
+                if select.select([conn], [], [], 1.0) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    on_kinds(conn.notifies.pop(0).payload.split(","))
+        except psycopg2.Error as e:
+            print("Invalidation listener error:", e)
+            time.sleep(retry_s)
+        finally:
+            if conn is not None:
+                conn.close()
 
+
+# PostgreSQL type OID -> Arrow type, for the column types our queries return.
+# Integers keep their PostgreSQL width (int2 -> int16, int4 -> int32); float4
+# is read as float64. Catalog kinds narrow further with their declared schema
+# (dictionary-encoded text, int8 status indices; see catalog.py).
+PG_TYPES = {
+    16: pa.bool_(),                       # bool
+    20: pa.int64(),                       # int8
+    21: pa.int16(),                       # int2
+    23: pa.int32(),                       # int4 (INT / SERIAL)
+    25: pa.string(),                      # text
+    700: pa.float64(),                    # float4
+    701: pa.float64(),                    # float8
+    1042: pa.string(),                    # bpchar
+    1043: pa.string(),                    # varchar
+    1082: pa.date32(),                    # date
+    1114: pa.timestamp("us"),             # timestamp
+    1184: pa.timestamp("us", tz="UTC"),   # timestamptz
+}
+
+
+def schema_from_description(description) -> pa.Schema:
+    """Build an Arrow schema from a DB-API cursor.description (unknown types -> string)."""
+    return pa.schema([
+        pa.field(col.name, PG_TYPES.get(col.type_code, pa.string()))
+        for col in description
+    ])
+
+
+def table_row_estimates(tables) -> dict[str, float]:
+    """
+    Planner row estimates (pg_class.reltuples) by table name; no table is
+    scanned. -1 for tables that were never analyzed or do not exist.
+    """
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT t, COALESCE(c.reltuples, -1)
+                FROM unnest(%(tables)s::text[]) AS t
+                LEFT JOIN pg_class c ON c.oid = to_regclass(quote_ident(t))
+            """, {"tables": list(tables)})
+            return {name: float(n) for name, n in cur.fetchall()}
+
+
+def _result_schema(description, schema: pa.Schema | None) -> pa.Schema:
+    """The caller's result schema if given (checked against the cursor's columns), else the inferred one."""
+    if schema is None:
+        return schema_from_description(description)
+    names = [col.name for col in description]
+    if names != schema.names:
+        raise ValueError(f"Result columns {names} do not match schema {schema.names}")
+    return schema
+
+
+def rows_to_batch(rows: list[tuple], schema: pa.Schema) -> pa.RecordBatch:
+    """
+    Convert cursor rows (tuples) into a RecordBatch column by column,
+    building each array with its declared type instead of inferring it.
+    """
     if not rows:
-        return pa.table({})
+        columns = [pa.array([], type=f.type) for f in schema]
+    else:
+        columns = [pa.array(col, type=f.type) for col, f in zip(zip(*rows), schema)]
+    return pa.RecordBatch.from_arrays(columns, schema=schema)
 
-    cols = rows[0].keys()
-    data = {col: [r[col] for r in rows] for col in cols}
-    return pa.Table.from_pydict(data)
 
+_NAMED_PARAM = re.compile(r"%\((\w+)\)s")
 
-def fetch_trips_overview(limit: int | None = None) -> pa.Table:
+_statement_lock = threading.Lock()
+_statement_stats = {"prepares": 0, "executions": 0, "plan_cache_hits": 0}
+
+
+def to_positional(sql: str) -> tuple[str, tuple[str, ...]]:
+    """Rewrite %(name)s placeholders to $1, $2, ... Returns the SQL and the names in $n order."""
+    names: list[str] = []
+
+    def number(m):
+        if m.group(1) not in names:
+            names.append(m.group(1))
+        return f"${names.index(m.group(1)) + 1}"
+
+    return _NAMED_PARAM.sub(number, sql).replace("%%", "%"), tuple(names)
+
+
+def execute_prepared(cur, sql: str, params: dict | None = None) -> None:
+    """
+    Execute sql as a server-side prepared statement of the cursor's
+    connection: PREPAREd on first use, afterwards only EXECUTE with the
+    bound parameters, so PostgreSQL skips parsing and (once it settles
+    on a generic plan) planning. Falls back to a plain execute on
+    connections that do not track prepared statements.
+    """
+    conn = cur.connection
+    prepared = getattr(conn, "prepared", None)
+    if prepared is None:
+        cur.execute(sql, params or {})
+        return
+
+    entry = prepared.get(sql)
+    hit = entry is not None
+    if entry is None:
+        positional, names = to_positional(sql)
+        name = "q_" + hashlib.md5(sql.encode()).hexdigest()[:16]
+        cur.execute(f"PREPARE {name} AS {positional}")
+        entry = prepared[sql] = (name, names)
+
+    name, names = entry
+    args = [(params or {})[n] for n in names]
+    try:
+        if args:
+            cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(args))})", args)
+        else:
+            cur.execute(f"EXECUTE {name}")
+    except psycopg2.errors.InvalidSqlStatementName:
+        # The session lost it (e.g. DISCARD ALL); prepare again next time.
+        prepared.pop(sql, None)
+        raise
+
+    with _statement_lock:
+        _statement_stats["executions"] += 1
+        if hit:
+            _statement_stats["plan_cache_hits"] += 1
+        else:
+            _statement_stats["prepares"] += 1
+
+
+def statement_stats() -> dict:
+    with _statement_lock:
+        executions = _statement_stats["executions"]
+        return {
+            **_statement_stats,
+            "hit_ratio": _statement_stats["plan_cache_hits"] / executions if executions else 0.0,
+        }
+
+
+def run_query(
+    sql: str,
+    params: dict | None = None,
+    timings: dict | None = None,
+    schema: pa.Schema | None = None,
+) -> pa.Table:
+    """
+    Run a query as a prepared statement and return the whole result.
+    For small results; large ones go through stream_query. timings, if
+    given, gets the same keys stream_query fills (db_fetch_ms stays 0).
+    schema works as in stream_query.
+    """
+    if timings is None:
+        timings = {}
+    with connection() as conn:
+        with conn.cursor() as cur:
+            t0 = time.perf_counter()
+            execute_prepared(cur, sql, params)
+            rows = cur.fetchall()
+            schema = _result_schema(cur.description, schema)
+            timings["db_first_ms"] = (time.perf_counter() - t0) * 1000.0
+
+    t0 = time.perf_counter()
+    table = pa.Table.from_batches([rows_to_batch(rows, schema)], schema=schema)
+    timings.update(
+        db_fetch_ms=0.0,
+        arrow_ms=(time.perf_counter() - t0) * 1000.0,
+        rows=table.num_rows,
+        batches=1,
+        prepared=True,
+    )
+    return table
+
+
+def stream_query(
+    sql: str,
+    params: dict | None = None,
+    chunk_rows: int = STREAM_CHUNK_ROWS,
+    timings: dict | None = None,
+    schema: pa.Schema | None = None,
+) -> tuple[pa.Schema, Iterator[pa.RecordBatch]]:
+    """
+    Run a query on a server-side (named) cursor.
+    Returns the result schema and a generator of RecordBatches with at most
+    chunk_rows rows each, so only one chunk is held in memory at a time.
+    The pooled connection stays checked out until the generator is
+    exhausted or closed.
+
+    If timings is given, it is filled with phase durations as the stream
+    progresses: db_first_ms (execute + first chunk), db_fetch_ms (later
+    chunks), arrow_ms (row -> Arrow conversion), rows, batches.
+
+    schema, if given, is the result schema to build batches with instead of
+    the one inferred from the cursor (same column names, in order), e.g. a
+    catalog schema with dictionary-encoded text columns: the encoding then
+    happens while the rows are converted, not as an extra pass.
+    """
+    if timings is None:
+        timings = {}
+    batches = _stream_batches(sql, params, chunk_rows, timings, schema)
+    schema = next(batches)
+    return schema, batches
+
+
+def _stream_batches(sql: str, params: dict | None, chunk_rows: int, timings: dict, schema: pa.Schema | None):
+    # First yield is the schema, then one RecordBatch per fetched chunk.
+    timings.update(db_first_ms=0.0, db_fetch_ms=0.0, arrow_ms=0.0, rows=0, batches=0)
+    with connection() as conn:
+        with conn.cursor(name=f"flight_{uuid.uuid4().hex}") as cur:
+            t0 = time.perf_counter()
+            cur.itersize = chunk_rows
+            cur.execute(sql, params or {})
+            rows = cur.fetchmany(chunk_rows)
+            schema = _result_schema(cur.description, schema)
+            timings["db_first_ms"] = (time.perf_counter() - t0) * 1000.0
+            yield schema
+
+            while rows:
+                t0 = time.perf_counter()
+                batch = rows_to_batch(rows, schema)
+                timings["arrow_ms"] += (time.perf_counter() - t0) * 1000.0
+                timings["rows"] += batch.num_rows
+                timings["batches"] += 1
+                yield batch
+
+                if len(rows) < chunk_rows:
+                    break
+                t0 = time.perf_counter()
+                rows = cur.fetchmany(chunk_rows)
+                timings["db_fetch_ms"] += (time.perf_counter() - t0) * 1000.0
+
+
+def trips_overview_query(
+    limit: int | None = None,
+    start_at: tuple | None = None,
+    after: tuple | None = None,
+    end_at: tuple | None = None,
+) -> tuple[str, dict | None]:
+    """
+    start_at=(start_time, trip_id) starts the listing at that row (inclusive),
+    after=(start_time, trip_id) right after it (exclusive), and
+    end_at=(start_time, trip_id) stops it before that row (exclusive), i.e.
+    keyset slices of the (start_time DESC, id DESC) order.
+    passenger_count is the trigger-maintained trip column (rollups.sql).
+    """
     sql = """
         SELECT
             t.id AS trip_id,
@@ -39,28 +351,197 @@ def fetch_trips_overview(limit: int | None = None) -> pa.Table:
             sl.street AS start_street,
             el.city AS end_city,
             el.street AS end_street,
-            COALESCE(p.passenger_count, 0) AS passenger_count
+            t.passenger_count
         FROM trip t
         JOIN "user" d ON t.driver_id = d.id
         JOIN vehicle v ON t.vehicle_id = v.id
         JOIN vehicle_type vt ON v.vehicle_type_id = vt.id
         JOIN location sl ON t.start_location_id = sl.id
         JOIN location el ON t.end_location_id = el.id
-        LEFT JOIN (
-            SELECT trip_id, COUNT(*) AS passenger_count
-            FROM trip_participant
-            GROUP BY trip_id
-        ) p ON p.trip_id = t.id
-        ORDER BY t.start_time DESC
     """
     params: dict = {}
+    # The plain start_time bounds let the planner use idx_trip_start_time_desc.
+    conditions = []
+    if start_at is not None:
+        conditions.append("t.start_time <= %(at_time)s AND (t.start_time, t.id) <= (%(at_time)s, %(at_id)s)")
+        params["at_time"], params["at_id"] = start_at
+    elif after is not None:
+        conditions.append("t.start_time <= %(at_time)s AND (t.start_time, t.id) < (%(at_time)s, %(at_id)s)")
+        params["at_time"], params["at_id"] = after
+    if end_at is not None:
+        conditions.append("t.start_time >= %(end_time)s AND (t.start_time, t.id) > (%(end_time)s, %(end_id)s)")
+        params["end_time"], params["end_id"] = end_at
+    if conditions:
+        sql += " WHERE " + "\n          AND ".join(conditions)
+    sql += " ORDER BY t.start_time DESC, t.id DESC"
     if limit is not None:
         sql += " LIMIT %(limit)s"
         params["limit"] = limit
-    return run_query(sql, params if params else None)
+    return sql, params if params else None
 
 
-def fetch_user_history(user_id: int, limit: int | None = None) -> pa.Table:
+def fetch_trips_overview(limit: int | None = None) -> pa.Table:
+    return run_query(*trips_overview_query(limit))
+
+
+def trips_overview_boundaries(limit: int | None, size: int) -> list[tuple]:
+    """
+    (start_time, id) of every size-th trip in trips_overview order, within
+    the first `limit` trips. Each boundary starts one partition, which ends
+    before the next boundary. Only touches the trip table.
+    """
+    sql = """
+        SELECT start_time, id
+        FROM (
+            SELECT start_time, id,
+                   row_number() OVER (ORDER BY start_time DESC, id DESC) - 1 AS rn
+            FROM trip
+            ORDER BY start_time DESC, id DESC
+            LIMIT %(limit)s
+        ) s
+        WHERE rn %% %(size)s = 0
+        ORDER BY rn
+    """
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql, {"limit": limit, "size": size})
+            return cur.fetchall()
+
+
+# Columns a trips command can select, filter and sort on: name -> (SQL
+# expression, joins it needs). Only the joins of the columns used are emitted.
+TRIPS_COLUMNS = {
+    "trip_id": ("t.id", ()),
+    "status": ("t.status", ()),
+    "start_time": ("t.start_time", ()),
+    "end_time": ("t.end_time", ()),
+    "driver_name": ("d.name", ("d",)),
+    "driver_surname": ("d.surname", ("d",)),
+    "vehicle_id": ("t.vehicle_id", ()),
+    "vehicle_type": ("vt.type", ("v", "vt")),
+    "vehicle_capacity": ("vt.capacity", ("v", "vt")),
+    "start_city": ("sl.city", ("sl",)),
+    "start_street": ("sl.street", ("sl",)),
+    "end_city": ("el.city", ("el",)),
+    "end_street": ("el.street", ("el",)),
+    "passenger_count": ("t.passenger_count", ()),
+    "company_id": ("t.company_id", ()),
+    "driver_id": ("t.driver_id", ()),
+}
+
+TRIPS_JOINS = {
+    "d": 'JOIN "user" d ON t.driver_id = d.id',
+    "v": "JOIN vehicle v ON t.vehicle_id = v.id",
+    "vt": "JOIN vehicle_type vt ON v.vehicle_type_id = vt.id",
+    "sl": "JOIN location sl ON t.start_location_id = sl.id",
+    "el": "JOIN location el ON t.end_location_id = el.id",
+}
+
+# Equality filters a trips command accepts -> Python type of the values
+TRIPS_FILTERS = {
+    "company_id": int,
+    "driver_id": int,
+    "vehicle_id": int,
+    "status": str,
+    "start_city": str,
+    "end_city": str,
+}
+
+
+def trips_query(
+    columns: list[str] | None = None,
+    where: dict | None = None,
+    start_from=None,
+    start_to=None,
+    order_by: list[tuple[str, str]] | None = None,
+    limit: int | None = None,
+) -> tuple[str, dict]:
+    """
+    Compile a trips command into parameterized SQL. Every identifier comes
+    from TRIPS_COLUMNS, every value is a bound parameter; anything else
+    raises ValueError.
+
+    where maps TRIPS_FILTERS columns to a value or a list of values (= ANY).
+    start_from / start_to bound start_time (inclusive / exclusive). The
+    default order is start_time DESC; trip_id is always appended as a
+    tie-breaker, so limits are deterministic and (start_time, company_id)
+    predicates can use idx_trip_start_time_desc / idx_trip_company_start_time_desc.
+    """
+    if columns is not None and (not isinstance(columns, list) or not all(isinstance(c, str) for c in columns)):
+        raise ValueError("columns must be a list of column names")
+    if where is not None and not isinstance(where, dict):
+        raise ValueError("where must be an object mapping columns to values")
+    if order_by is not None and not (
+        isinstance(order_by, list)
+        and all(isinstance(o, (list, tuple)) and len(o) == 2 and all(isinstance(x, str) for x in o) for o in order_by)
+    ):
+        raise ValueError("order_by must be a list of [column, direction] pairs")
+
+    columns = list(columns) if columns is not None else list(TRIPS_COLUMNS)
+    if not columns:
+        raise ValueError("columns must not be empty")
+    unknown = [c for c in columns if c not in TRIPS_COLUMNS]
+    if unknown:
+        raise ValueError(f"unknown columns: {', '.join(map(str, unknown))}")
+    if len(set(columns)) != len(columns):
+        raise ValueError("duplicate columns")
+
+    order_by = [tuple(o) for o in order_by] if order_by else [("start_time", "desc")]
+    for column, direction in order_by:
+        if column not in TRIPS_COLUMNS or direction.lower() not in ("asc", "desc"):
+            raise ValueError(f"bad order_by entry: {column!r} {direction!r}")
+    if "trip_id" not in (column for column, _ in order_by):
+        order_by.append(("trip_id", order_by[-1][1]))
+
+    params: dict = {}
+    conditions = []
+    for column, value in (where or {}).items():
+        if column not in TRIPS_FILTERS:
+            raise ValueError(f"cannot filter on {column!r}; use one of {', '.join(TRIPS_FILTERS)}")
+        values = value if isinstance(value, list) else [value]
+        kind = TRIPS_FILTERS[column]
+        if not values or any(type(v) is not kind for v in values):
+            raise ValueError(f"{column} must be {kind.__name__} or a non-empty list of {kind.__name__}")
+        name = f"w_{column}"
+        op = "= ANY(%({})s)" if isinstance(value, list) else "= %({})s"
+        conditions.append(f"{TRIPS_COLUMNS[column][0]} {op.format(name)}")
+        params[name] = value
+    if start_from is not None:
+        conditions.append("t.start_time >= %(start_from)s")
+        params["start_from"] = start_from
+    if start_to is not None:
+        conditions.append("t.start_time < %(start_to)s")
+        params["start_to"] = start_to
+
+    used = set(columns) | set(where or {}) | {column for column, _ in order_by}
+    aliases = {alias for c in used for alias in TRIPS_COLUMNS[c][1]}
+    lines = ["SELECT", ",\n".join(f"    {TRIPS_COLUMNS[c][0]} AS {c}" for c in columns), "FROM trip t"]
+    lines += [join for alias, join in TRIPS_JOINS.items() if alias in aliases]
+    if conditions:
+        lines.append("WHERE " + "\n  AND ".join(conditions))
+    lines.append("ORDER BY " + ", ".join(f"{TRIPS_COLUMNS[c][0]} {d.upper()}" for c, d in order_by))
+    sql = "\n".join(lines)
+    if limit is not None:
+        if type(limit) is not int or limit < 0:
+            raise ValueError("limit must be a non-negative integer")
+        sql += " LIMIT %(limit)s"
+        params["limit"] = limit
+    return sql, params
+
+
+def user_history_query(
+    user_id: int,
+    limit: int | None = None,
+    after: tuple | None = None,
+    with_participant_id: bool = False,
+) -> tuple[str, dict]:
+    """
+    Rows are in (start_time DESC, id DESC, participant id DESC) order; the
+    participant id tells apart several participations in one trip.
+    after=(start_time, trip_id, participant_id) starts the history right
+    after that row (exclusive), i.e. a keyset slice of that order.
+    with_participant_id adds the participant id as a participant_id column.
+    """
     sql = """
         SELECT
             t.id AS trip_id,
@@ -70,140 +551,251 @@ def fetch_user_history(user_id: int, limit: int | None = None) -> pa.Table:
             d.name AS driver_name,
             d.surname AS driver_surname,
             CASE WHEN t.driver_id = %(uid)s THEN TRUE ELSE FALSE END AS is_driver
+    """
+    if with_participant_id:
+        sql += """,
+            tp.id AS participant_id
+        """
+    sql += """
         FROM trip t
         JOIN "user" d ON t.driver_id = d.id
         JOIN trip_participant tp ON tp.trip_id = t.id
         WHERE tp.user_id = %(uid)s
-        ORDER BY t.start_time DESC
     """
     params: dict = {"uid": user_id}
+    if after is not None:
+        sql += """
+          AND t.start_time <= %(at_time)s
+          AND (t.start_time, t.id, tp.id) < (%(at_time)s, %(at_id)s, %(at_participant)s)
+        """
+        params["at_time"], params["at_id"], params["at_participant"] = after
+    sql += " ORDER BY t.start_time DESC, t.id DESC, tp.id DESC"
     if limit is not None:
         sql += " LIMIT %(limit)s"
         params["limit"] = limit
-    return run_query(sql, params)
+    return sql, params
 
 
-def fetch_company_daily_stats(company_id: int, limit: int | None = None) -> pa.Table:
+def user_history_batch_query(
+    user_ids: list[int],
+    limits: list[int | None] | None = None,
+) -> tuple[str, dict]:
+    """
+    History of many users in one statement: the user_history query as a
+    LATERAL subquery per (user_id, limit) pair of the unnested input.
+    Rows are tagged with user_id and come back in input order, each
+    user's trips in (start_time DESC, id DESC) order. A None limit means
+    the full history.
+    """
     sql = """
         SELECT
-            date_trunc('day', t.start_time) AS day,
-            COUNT(*) AS trips,
-            AVG(p_count) AS avg_passengers
-        FROM trip t
-        LEFT JOIN (
-            SELECT trip_id, COUNT(*)::float AS p_count
-            FROM trip_participant
-            GROUP BY trip_id
-        ) p ON p.trip_id = t.id
-        WHERE t.company_id = %(cid)s
-        GROUP BY day
+            u.user_id,
+            h.trip_id,
+            h.start_time,
+            h.end_time,
+            h.status,
+            h.driver_name,
+            h.driver_surname,
+            h.is_driver
+        FROM unnest(%(uids)s::int[], %(limits)s::int[]) WITH ORDINALITY AS u(user_id, lim, ord)
+        CROSS JOIN LATERAL (
+            SELECT
+                t.id AS trip_id,
+                t.start_time,
+                t.end_time,
+                t.status,
+                d.name AS driver_name,
+                d.surname AS driver_surname,
+                CASE WHEN t.driver_id = u.user_id THEN TRUE ELSE FALSE END AS is_driver
+            FROM trip t
+            JOIN "user" d ON t.driver_id = d.id
+            JOIN trip_participant tp ON tp.trip_id = t.id
+            WHERE tp.user_id = u.user_id
+            ORDER BY t.start_time DESC, t.id DESC
+            LIMIT u.lim
+        ) h
+        ORDER BY u.ord, h.start_time DESC, h.trip_id DESC
+    """
+    if limits is None:
+        limits = [None] * len(user_ids)
+    return sql, {"uids": list(user_ids), "limits": list(limits)}
+
+
+def fetch_user_history(user_id: int, limit: int | None = None) -> pa.Table:
+    return run_query(*user_history_query(user_id, limit))
+
+
+def company_daily_stats_query(company_id: int, limit: int | None = None) -> tuple[str, dict]:
+    """
+    Reads the trigger-maintained company_daily_stats rollup (rollups.sql),
+    so cost scales with the number of days, not trips.
+    """
+    sql = """
+        SELECT
+            day,
+            trips,
+            passenger_sum::float / NULLIF(trips_with_passengers, 0) AS avg_passengers
+        FROM company_daily_stats
+        WHERE company_id = %(cid)s
         ORDER BY day DESC
     """
     params: dict = {"cid": company_id}
     if limit is not None:
         sql += " LIMIT %(limit)s"
         params["limit"] = limit
-    return run_query(sql, params)
+    return sql, params
 
-def insert_trips_rows(rows: list[tuple]) -> int:
-    """
-    Bulk insert into trip. Returns number of inserted rows.
-    rows tuples order:
-      (vehicle_id, driver_id, company_id, start_time, end_time,
-       start_location_id, end_location_id, status)
-    """
-    if not rows:
-        return 0
-
-    sql = """
-        INSERT INTO trip (
-            vehicle_id, driver_id, company_id,
-            start_time, end_time,
-            start_location_id, end_location_id,
-            status
-        )
-        VALUES %s
-    """
 
-    conn = psycopg2.connect(DB_CONN)
-    try:
-        with conn.cursor() as cur:
-            execute_values(cur, sql, rows, page_size=5000)
-        conn.commit()
-        return len(rows)
-    finally:
-        conn.close()
+def fetch_company_daily_stats(company_id: int, limit: int | None = None) -> pa.Table:
+    return run_query(*company_daily_stats_query(company_id, limit))
 
 
-def insert_trip_participants_rows(rows: list[tuple]) -> int:
+def copy_batch(cur, table: str, columns: tuple[str, ...], batch: pa.RecordBatch) -> int:
     """
-    Bulk insert into trip_participant. Returns number of inserted rows.
-    rows tuples order:
-      (trip_id, user_id, pickup_location_id, dropoff_location_id, status)
+    Bulk load one Arrow record batch with COPY ... FROM STDIN.
+    The batch is serialized to CSV by Arrow (no per-row Python objects);
+    nulls become unquoted empty fields, which COPY reads as NULL.
+    The caller owns the transaction. Returns number of copied rows.
     """
-    if not rows:
+    if batch.num_rows == 0:
         return 0
 
-    sql = """
-        INSERT INTO trip_participant (
-            trip_id, user_id,
-            pickup_location_id, dropoff_location_id,
-            status
-        )
-        VALUES %s
-    """
+    buf = pa.BufferOutputStream()
+    pcsv.write_csv(batch.select(list(columns)), buf, pcsv.WriteOptions(include_header=False))
 
-    conn = psycopg2.connect(DB_CONN)
-    try:
-        with conn.cursor() as cur:
-            execute_values(cur, sql, rows, page_size=5000)
-        conn.commit()
-        return len(rows)
-    finally:
-        conn.close()
+    cur.copy_expert(
+        f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+        pa.BufferReader(buf.getvalue()),
+    )
+    return batch.num_rows
 
-def fetch_driver_ids(limit: int = 5000) -> pa.Table:
+def driver_ids_query(limit: int = 5000) -> tuple[str, dict]:
     sql = """
         SELECT id
         FROM "user"
         WHERE has_drivers_license = TRUE
         LIMIT %(limit)s
     """
-    return run_query(sql, {"limit": limit})
+    return sql, {"limit": limit}
 
 
-def fetch_user_ids(limit: int = 5000) -> pa.Table:
+def fetch_driver_ids(limit: int = 5000) -> pa.Table:
+    return run_query(*driver_ids_query(limit))
+
+
+def user_ids_query(limit: int = 5000) -> tuple[str, dict]:
     sql = """
         SELECT id
         FROM "user"
         LIMIT %(limit)s
     """
-    return run_query(sql, {"limit": limit})
+    return sql, {"limit": limit}
 
 
-def fetch_location_ids(loc_type: str, limit: int = 5000) -> pa.Table:
+def fetch_user_ids(limit: int = 5000) -> pa.Table:
+    return run_query(*user_ids_query(limit))
+
+
+def location_ids_query(loc_type: str, limit: int = 5000) -> tuple[str, dict]:
     sql = """
         SELECT id
         FROM location
         WHERE type = %(t)s
         LIMIT %(limit)s
     """
-    return run_query(sql, {"t": loc_type, "limit": limit})
+    return sql, {"t": loc_type, "limit": limit}
 
 
-def fetch_trip_ids(limit: int = 5000) -> pa.Table:
+def fetch_location_ids(loc_type: str, limit: int = 5000) -> pa.Table:
+    return run_query(*location_ids_query(loc_type, limit))
+
+
+def trip_ids_query(limit: int = 5000) -> tuple[str, dict]:
     sql = """
         SELECT id
         FROM trip
         LIMIT %(limit)s
     """
-    return run_query(sql, {"limit": limit})
+    return sql, {"limit": limit}
 
-def fetch_vehicle_ids(limit: int = 5000) -> pa.Table:
+
+def fetch_trip_ids(limit: int = 5000) -> pa.Table:
+    return run_query(*trip_ids_query(limit))
+
+def vehicle_ids_query(limit: int = 5000) -> tuple[str, dict]:
     sql = """
         SELECT id
         FROM vehicle
         LIMIT %(limit)s
     """
-    return run_query(sql, {"limit": limit})
+    return sql, {"limit": limit}
+
+
+def fetch_vehicle_ids(limit: int = 5000) -> pa.Table:
+    return run_query(*vehicle_ids_query(limit))
+
+
+
+# Pool name -> (table, extra WHERE). Pool names are the keys ingest.fetch_pools returns.
+ID_POOLS = {
+    "vehicle_ids": ("vehicle", None),
+    "driver_ids": ('"user"', "has_drivers_license = TRUE"),
+    "user_ids": ('"user"', None),
+    "home_ids": ("location", "type = 'HOME'"),
+    "office_ids": ("location", "type = 'OFFICE'"),
+    "pickup_ids": ("location", "type = 'PICKUP_POINT'"),
+    "trip_ids": ("trip", None),
+}
+
+
+def ids_all_query(limit: int = 5000) -> tuple[str, dict]:
+    """Every ID pool in one result, long format: (pool, id)."""
+    parts = []
+    for pool, (table, where) in ID_POOLS.items():
+        parts.append(f"""
+        (SELECT '{pool}' AS pool, id
+         FROM {table}
+         {f"WHERE {where}" if where else ""}
+         LIMIT %(limit)s)""")
+    sql = "\n        UNION ALL".join(parts)
+    return sql, {"limit": limit}
+
+
+def fetch_ids_all(limit: int = 5000) -> pa.Table:
+    return run_query(*ids_all_query(limit))
+
+
+def rewrites_version() -> tuple:
+    """
+    Count of UPDATE / DELETE / TRUNCATE statements on the tables behind
+    the ID pools and the snapshot (data_versions.rewrites, from
+    rollups.sql) plus the rollups.sql epoch. Inserts leave it unchanged.
+    """
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT
+                    (SELECT SUM(version) FROM data_versions WHERE table_name = 'epoch'),
+                    (SELECT SUM(rewrites) FROM data_versions WHERE table_name <> 'epoch')
+            """)
+            return tuple(cur.fetchone())
+
 
+def ids_data_version() -> str:
+    """
+    Fingerprint of the tables behind the ID pools: their write counters
+    (data_versions, bumped by triggers from rollups.sql on every insert,
+    update, delete and truncate), after the epoch each run of rollups.sql
+    sets. Changes with every committed write and every reseeded database.
+    """
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT
+                    (SELECT SUM(version) FROM data_versions WHERE table_name = 'epoch'),
+                    (SELECT SUM(version) FROM data_versions WHERE table_name = 'vehicle'),
+                    (SELECT SUM(version) FROM data_versions WHERE table_name = 'user'),
+                    (SELECT SUM(version) FROM data_versions WHERE table_name = 'location'),
+                    (SELECT SUM(version) FROM data_versions WHERE table_name = 'trip')
+            """)
+            return "-".join(str(v or 0) for v in cur.fetchone())
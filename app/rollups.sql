@@ -0,0 +1,292 @@
+-- ============================================================
+-- Derived data maintained by triggers (PostgreSQL)
+-- Safe to re-run: (re)creates tables, functions and triggers
+-- and rebuilds the derived data from trip / trip_participant.
+-- ============================================================
+
+BEGIN;
+
+-- Block writers while the derived data is rebuilt.
+LOCK TABLE trip, trip_participant IN SHARE ROW EXCLUSIVE MODE;
+
+
+-- ----------------------------
+-- TRIP.PASSENGER_COUNT: participants per trip
+-- ----------------------------
+
+-- Read directly by trips_overview instead of aggregating trip_participant
+-- on every request. Maintained by the trip_participant trigger below.
+ALTER TABLE trip ADD COLUMN IF NOT EXISTS passenger_count INT NOT NULL DEFAULT 0;
+
+
+-- ----------------------------
+-- COMPANY_DAILY_STATS: rollup behind the company_stats flight
+-- ----------------------------
+
+-- One row per (company, day). day is date_trunc('day', start_time) in the
+-- session time zone of the writer, i.e. the database default time zone.
+-- avg_passengers = passenger_sum / trips_with_passengers, which is the
+-- average over trips that have at least one participant.
+CREATE TABLE IF NOT EXISTS company_daily_stats (
+    company_id              INT NOT NULL,
+    day                     TIMESTAMPTZ NOT NULL,
+    trips                   BIGINT NOT NULL DEFAULT 0,
+    trips_with_passengers   BIGINT NOT NULL DEFAULT 0,
+    passenger_sum           BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (company_id, day)
+);
+
+-- Add per-(company, day) deltas; days left without trips are removed.
+CREATE OR REPLACE FUNCTION company_daily_stats_merge(deltas company_daily_stats[]) RETURNS void
+LANGUAGE sql AS $$
+    INSERT INTO company_daily_stats AS s (company_id, day, trips, trips_with_passengers, passenger_sum)
+    SELECT company_id, day, SUM(trips), SUM(trips_with_passengers), SUM(passenger_sum)
+    FROM unnest(deltas)
+    GROUP BY 1, 2
+    HAVING SUM(trips) <> 0 OR SUM(trips_with_passengers) <> 0 OR SUM(passenger_sum) <> 0
+    ORDER BY 1, 2
+    ON CONFLICT (company_id, day) DO UPDATE
+        SET trips = s.trips + EXCLUDED.trips,
+            trips_with_passengers = s.trips_with_passengers + EXCLUDED.trips_with_passengers,
+            passenger_sum = s.passenger_sum + EXCLUDED.passenger_sum;
+
+    DELETE FROM company_daily_stats s
+    USING unnest(deltas) d
+    WHERE s.company_id = d.company_id AND s.day = d.day AND s.trips = 0;
+$$;
+
+-- Trips inserted, deleted or updated (including passenger_count, which
+-- the trip_participant triggers change): take the old rows out of their
+-- days and put the new ones in.
+CREATE OR REPLACE FUNCTION trip_company_daily_stats() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    deltas company_daily_stats[] := '{}';
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        deltas := deltas || ARRAY(
+            SELECT ROW(company_id, date_trunc('day', start_time),
+                       -COUNT(*), -COUNT(*) FILTER (WHERE passenger_count > 0), -SUM(passenger_count))::company_daily_stats
+            FROM old_trips
+            GROUP BY company_id, date_trunc('day', start_time)
+        );
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        deltas := deltas || ARRAY(
+            SELECT ROW(company_id, date_trunc('day', start_time),
+                       COUNT(*), COUNT(*) FILTER (WHERE passenger_count > 0), SUM(passenger_count))::company_daily_stats
+            FROM new_trips
+            GROUP BY company_id, date_trunc('day', start_time)
+        );
+    END IF;
+    PERFORM company_daily_stats_merge(deltas);
+    RETURN NULL;
+END;
+$$;
+
+-- Participants inserted, deleted or moved to another trip: adjust
+-- trip.passenger_count; the trip triggers carry it into company_daily_stats.
+CREATE OR REPLACE FUNCTION trip_participant_counts() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    added INT[] := '{}';
+    removed INT[] := '{}';
+    trip_ids INT[];
+    counts INT[];
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        added := ARRAY(SELECT trip_id FROM new_participants);
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        removed := ARRAY(SELECT trip_id FROM old_participants);
+    END IF;
+
+    SELECT array_agg(trip_id ORDER BY trip_id), array_agg(n ORDER BY trip_id)
+    INTO trip_ids, counts
+    FROM (
+        SELECT trip_id, SUM(n) AS n
+        FROM (
+            SELECT unnest(added) AS trip_id, 1 AS n
+            UNION ALL
+            SELECT unnest(removed), -1
+        ) c
+        GROUP BY trip_id
+        HAVING SUM(n) <> 0
+    ) d;
+    IF trip_ids IS NULL THEN
+        RETURN NULL;
+    END IF;
+
+    -- Concurrent writers (e.g. parallel DoPut streams) touch overlapping
+    -- trips and days: take the row locks in key order so they cannot deadlock.
+    PERFORM 1
+    FROM trip
+    WHERE id = ANY(trip_ids)
+    ORDER BY id
+    FOR NO KEY UPDATE;
+
+    UPDATE trip t
+    SET passenger_count = t.passenger_count + d.n
+    FROM unnest(trip_ids, counts) AS d(trip_id, n)
+    WHERE t.id = d.trip_id;
+    RETURN NULL;
+END;
+$$;
+
+-- Statement-level triggers with transition tables: one update per
+-- INSERT / COPY / UPDATE / DELETE, however many rows it carries.
+-- A transition-table trigger covers one event, hence one trigger per event.
+-- TRUNCATE is not tracked: re-run this script after truncating either table.
+DROP TRIGGER IF EXISTS trip_company_daily_stats ON trip;
+CREATE TRIGGER trip_company_daily_stats
+AFTER INSERT ON trip
+REFERENCING NEW TABLE AS new_trips
+FOR EACH STATEMENT EXECUTE FUNCTION trip_company_daily_stats();
+
+DROP TRIGGER IF EXISTS trip_company_daily_stats_update ON trip;
+CREATE TRIGGER trip_company_daily_stats_update
+AFTER UPDATE ON trip
+REFERENCING OLD TABLE AS old_trips NEW TABLE AS new_trips
+FOR EACH STATEMENT EXECUTE FUNCTION trip_company_daily_stats();
+
+DROP TRIGGER IF EXISTS trip_company_daily_stats_delete ON trip;
+CREATE TRIGGER trip_company_daily_stats_delete
+AFTER DELETE ON trip
+REFERENCING OLD TABLE AS old_trips
+FOR EACH STATEMENT EXECUTE FUNCTION trip_company_daily_stats();
+
+DROP TRIGGER IF EXISTS trip_participant_counts ON trip_participant;
+CREATE TRIGGER trip_participant_counts
+AFTER INSERT ON trip_participant
+REFERENCING NEW TABLE AS new_participants
+FOR EACH STATEMENT EXECUTE FUNCTION trip_participant_counts();
+
+DROP TRIGGER IF EXISTS trip_participant_counts_update ON trip_participant;
+CREATE TRIGGER trip_participant_counts_update
+AFTER UPDATE ON trip_participant
+REFERENCING OLD TABLE AS old_participants NEW TABLE AS new_participants
+FOR EACH STATEMENT EXECUTE FUNCTION trip_participant_counts();
+
+DROP TRIGGER IF EXISTS trip_participant_counts_delete ON trip_participant;
+CREATE TRIGGER trip_participant_counts_delete
+AFTER DELETE ON trip_participant
+REFERENCING OLD TABLE AS old_participants
+FOR EACH STATEMENT EXECUTE FUNCTION trip_participant_counts();
+
+-- replaced by trip_company_daily_stats() and trip_participant_counts()
+DROP TRIGGER IF EXISTS trip_participant_company_daily_stats ON trip_participant;
+DROP FUNCTION IF EXISTS company_daily_stats_add_participants();
+DROP FUNCTION IF EXISTS company_daily_stats_add_trips();
+DROP FUNCTION IF EXISTS trip_participant_add_counts();
+
+
+-- ----------------------------
+-- DATA_VERSIONS: write counters behind the ids_all data_version and
+-- the in-memory snapshot's reload check
+-- ----------------------------
+
+-- Every INSERT / UPDATE / DELETE / TRUNCATE statement on a table behind the
+-- ID pools or the snapshot bumps version; all but INSERT also bump
+-- rewrites (writes an append-only reader cannot pick up). A table's
+-- counters are the sums over its stripes. The 'epoch' row is replaced by
+-- every run of this script (see the end).
+-- Writers pick a stripe by backend, so concurrent DoPut streams do not
+-- queue on one row lock. Bumps are transactional: the version changes
+-- exactly when the write becomes visible. Writes made by the triggers
+-- above (passenger_count) are derived data and not counted.
+CREATE TABLE IF NOT EXISTS data_versions (
+    table_name  TEXT NOT NULL,
+    stripe      INT NOT NULL,
+    version     BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (table_name, stripe)
+);
+ALTER TABLE data_versions ADD COLUMN IF NOT EXISTS rewrites BIGINT NOT NULL DEFAULT 0;
+
+CREATE OR REPLACE FUNCTION data_versions_bump() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF pg_trigger_depth() > 1 THEN
+        RETURN NULL;
+    END IF;
+    INSERT INTO data_versions AS v (table_name, stripe, version, rewrites)
+    VALUES (TG_TABLE_NAME, pg_backend_pid() % 16, 1, CASE WHEN TG_OP = 'INSERT' THEN 0 ELSE 1 END)
+    ON CONFLICT (table_name, stripe) DO UPDATE
+        SET version = v.version + 1,
+            rewrites = v.rewrites + EXCLUDED.rewrites;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS vehicle_data_version ON vehicle;
+CREATE TRIGGER vehicle_data_version
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON vehicle
+FOR EACH STATEMENT EXECUTE FUNCTION data_versions_bump();
+
+DROP TRIGGER IF EXISTS user_data_version ON "user";
+CREATE TRIGGER user_data_version
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON "user"
+FOR EACH STATEMENT EXECUTE FUNCTION data_versions_bump();
+
+DROP TRIGGER IF EXISTS location_data_version ON location;
+CREATE TRIGGER location_data_version
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON location
+FOR EACH STATEMENT EXECUTE FUNCTION data_versions_bump();
+
+DROP TRIGGER IF EXISTS trip_data_version ON trip;
+CREATE TRIGGER trip_data_version
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON trip
+FOR EACH STATEMENT EXECUTE FUNCTION data_versions_bump();
+
+DROP TRIGGER IF EXISTS trip_participant_data_version ON trip_participant;
+CREATE TRIGGER trip_participant_data_version
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON trip_participant
+FOR EACH STATEMENT EXECUTE FUNCTION data_versions_bump();
+
+DROP TRIGGER IF EXISTS vehicle_type_data_version ON vehicle_type;
+CREATE TRIGGER vehicle_type_data_version
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON vehicle_type
+FOR EACH STATEMENT EXECUTE FUNCTION data_versions_bump();
+
+
+-- ----------------------------
+-- Rebuild from the base tables
+-- ----------------------------
+
+UPDATE trip t
+SET passenger_count = p.n
+FROM (
+    SELECT trip_id, COUNT(*) AS n
+    FROM trip_participant
+    GROUP BY trip_id
+) p
+WHERE p.trip_id = t.id
+  AND t.passenger_count <> p.n;
+
+UPDATE trip t
+SET passenger_count = 0
+WHERE t.passenger_count <> 0
+  AND NOT EXISTS (SELECT 1 FROM trip_participant tp WHERE tp.trip_id = t.id);
+
+TRUNCATE company_daily_stats;
+
+INSERT INTO company_daily_stats (company_id, day, trips, trips_with_passengers, passenger_sum)
+SELECT
+    company_id,
+    date_trunc('day', start_time),
+    COUNT(*),
+    COUNT(*) FILTER (WHERE passenger_count > 0),
+    SUM(passenger_count)
+FROM trip
+GROUP BY 1, 2;
+
+-- New epoch of the ids_all data_version: a database (re)built and seeded
+-- from scratch does not reuse the version of an earlier one.
+INSERT INTO data_versions AS v (table_name, stripe, version)
+VALUES ('epoch', 0, floor(random() * 1e15)::bigint)
+ON CONFLICT (table_name, stripe) DO UPDATE
+    SET version = EXCLUDED.version;
+
+ANALYZE trip;
+ANALYZE company_daily_stats;
+
+COMMIT;
@@ -1,26 +1,137 @@
 import os
+import json
+import time
+import uuid
+import datetime
+import itertools
+import multiprocessing
+import signal
+import socket
+import threading
+from collections import OrderedDict
 import pyarrow as pa
+import pyarrow.compute as pc
 import pyarrow.flight as fl
 import psycopg2
 
 from queries import (
-    fetch_trips_overview,
-    fetch_user_history,
-    fetch_company_daily_stats,
-    insert_trips_rows,
-    insert_trip_participants_rows,
-    fetch_vehicle_ids,
-    fetch_driver_ids,
-    fetch_user_ids,
-    fetch_location_ids,
-    fetch_trip_ids
+    stream_query,
+    trips_overview_query,
+    trips_overview_boundaries,
+    user_history_query,
+    trips_query,
+    user_history_batch_query,
+    company_daily_stats_query,
+    connection,
+    copy_batch,
+    vehicle_ids_query,
+    driver_ids_query,
+    user_ids_query,
+    location_ids_query,
+    trip_ids_query,
+    ids_all_query,
+    ids_data_version,
+    notify_invalidation,
+    run_query,
+    statement_stats,
+    listen_invalidations,
+    pool_stats,
+    STREAM_CHUNK_ROWS,
+)
+from cache import ResultCache
+from export import EXPORT_ROW_GROUP_ROWS, ExportWriter
+from snapshot import SNAPSHOT_KINDS, TripSnapshot
+from catalog import FLIGHT_CATALOG, USER_HISTORY_BATCH_SCHEMA, RowEstimates, trips_schema
+from validation import (
+    TRIP_SCHEMA,
+    TRIP_PARTICIPANT_SCHEMA,
+    TRIP_STATUSES,
+    TRIP_PARTICIPANT_STATUSES,
+    check_schema,
+    coerce_batch,
+    optional_str,
+    positive_int,
+    reject_rows,
 )
 
 
 FLIGHT_PORT = int(os.environ.get("FLIGHT_PORT", "8815"))
+# > 1: FLIGHT_PORT only plans; DoGets go to worker processes on FLIGHT_PORT+1..FLIGHT_PORT+N
+FLIGHT_WORKERS = int(os.environ.get("FLIGHT_WORKERS", "1"))
+# Host name clients use to reach the worker ports
+FLIGHT_ADVERTISE_HOST = os.environ.get("FLIGHT_ADVERTISE_HOST", socket.gethostname())
+FLIGHT_PARTITIONS = int(os.environ.get("FLIGHT_PARTITIONS", str(min(4, os.cpu_count() or 1))))
+FLIGHT_PARTITION_MIN_ROWS = int(os.environ.get("FLIGHT_PARTITION_MIN_ROWS", "50000"))
+FLIGHT_TIMINGS_KEEP = int(os.environ.get("FLIGHT_TIMINGS_KEEP", "1000"))
+FLIGHT_CACHE_MAX_MB = int(os.environ.get("FLIGHT_CACHE_MAX_MB", "256"))
+# Larger results are streamed without being cached
+FLIGHT_CACHE_ENTRY_MAX_MB = int(os.environ.get("FLIGHT_CACHE_ENTRY_MAX_MB", "32"))
+# Directory the export action writes its Parquet / Arrow IPC files to
+FLIGHT_EXPORT_DIR = os.environ.get("FLIGHT_EXPORT_DIR", "exports")
+
+# Result cache TTL (seconds) per query kind; 0 disables caching for a kind.
+# Override with e.g. FLIGHT_CACHE_TTL_S="company_stats=300,trips_overview=0"
+CACHE_TTL_S = {
+    "trips_overview": 10,
+    "trips_overview_page": 10,
+    "trips": 10,
+    "user_history": 10,
+    "user_history_page": 10,
+    "company_stats": 60,
+    "ids_vehicle": 300,
+    "ids_driver": 300,
+    "ids_user": 300,
+    "ids_location_home": 300,
+    "ids_location_office": 300,
+    "ids_location_pickup": 300,
+    "ids_trip": 60,
+    "ids_all": 60,
+}
+for _item in filter(None, os.environ.get("FLIGHT_CACHE_TTL_S", "").split(",")):
+    _kind, _ttl = _item.split("=")
+    CACHE_TTL_S[_kind.strip()] = float(_ttl)
+
+# Engine answering each kind: "postgres" (default) or "snapshot" (in-memory
+# TripSnapshot, only for SNAPSHOT_KINDS), e.g. FLIGHT_ENGINE="trips_overview=snapshot"
+ENGINES = {}
+for _item in filter(None, os.environ.get("FLIGHT_ENGINE", "").split(",")):
+    _kind, _engine = (x.strip() for x in _item.split("="))
+    if _engine not in ("postgres", "snapshot") or (_engine == "snapshot" and _kind not in SNAPSHOT_KINDS):
+        raise ValueError(f"FLIGHT_ENGINE: cannot serve {_kind!r} from {_engine!r}")
+    ENGINES[_kind] = _engine
+
+# IPC body compression of DoGet streams: request header, default codec and accepted names
+COMPRESSION_HEADER = "x-arrow-compression"
+FLIGHT_COMPRESSION = os.environ.get("FLIGHT_COMPRESSION", "none").lower()
+CODECS = {"none": None, "lz4": "lz4", "lz4_frame": "lz4", "zstd": "zstd"}
+
+# Results with a LIMIT up to this many rows use prepared statements (run_query)
+FLIGHT_PREPARED_MAX_ROWS = int(os.environ.get("FLIGHT_PREPARED_MAX_ROWS", "10000"))
+FLIGHT_PUT_MAX_ERRORS = int(os.environ.get("FLIGHT_PUT_MAX_ERRORS", "100"))
+
+# DoPut endpoint -> (target table, Arrow schema batches are coerced to, allowed status values)
+PUT_TARGETS = {
+    "insert_trip": ("trip", TRIP_SCHEMA, TRIP_STATUSES),
+    "insert_trip_participant": ("trip_participant", TRIP_PARTICIPANT_SCHEMA, TRIP_PARTICIPANT_STATUSES),
+}
+
+# Table written by DoPut -> query kinds whose cached results it makes stale
+PUT_INVALIDATES = {
+    "trip": (
+        "trips", "trips_overview", "trips_overview_page",
+        "user_history", "user_history_page",
+        "company_stats", "ids_trip", "ids_all",
+    ),
+    "trip_participant": (
+        "trips", "trips_overview", "trips_overview_page",
+        "user_history", "user_history_page",
+        "company_stats",
+    ),
+}
 
 FLIGHTS = (
     "trips_overview", "user_history", "company_stats",
+    "trips_overview_page", "user_history_page",
     "ids_vehicle",
     "ids_driver",
     "ids_user",
@@ -28,194 +139,873 @@ FLIGHTS = (
     "ids_location_office",
     "ids_location_pickup",
     "ids_trip",
+    "ids_all",
 )
 
+
+# Columns of the last row of a user_history_page that position the next page
+USER_HISTORY_PAGE_KEYS = ("start_time", "trip_id", "participant_id")
+
+
+def page_after(parts: list[str], keys: tuple[str, ...] = ("start_time", "trip_id")) -> tuple | None:
+    """
+    Keyset position of a *_page path: the `keys` values of the last row of
+    the previous page (start_time as ISO 8601, naive taken as UTC; the rest
+    integers), or None for the first page.
+    """
+    if not parts:
+        return None
+    if len(parts) != len(keys):
+        raise ValueError("a page position is " + "/".join(f"<{k}>" for k in keys))
+    start_time = datetime.datetime.fromisoformat(parts[0])
+    if start_time.tzinfo is None:
+        start_time = start_time.replace(tzinfo=datetime.timezone.utc)
+    return (start_time, *(int(p) for p in parts[1:]))
+
+
+class CompressionMiddleware(fl.ServerMiddleware):
+    def __init__(self, codec: str):
+        self.codec = codec
+
+
+class CompressionMiddlewareFactory(fl.ServerMiddlewareFactory):
+    """Picks up the codec a client asks for in the x-arrow-compression header."""
+
+    def start_call(self, info, headers):
+        values = headers.get(COMPRESSION_HEADER)
+        if not values:
+            return None
+        codec = values[0].lower()
+        if codec not in CODECS:
+            raise fl.FlightServerError(f"Unsupported compression {codec!r}; use one of {', '.join(CODECS)}")
+        return CompressionMiddleware(codec)
+
+
 class CommuteFlightServer(fl.FlightServerBase):
-    def __init__(self, host: str = "0.0.0.0", port: int = FLIGHT_PORT):
+    """
+    Stand-alone by default. With worker_ports, it acts as a coordinator:
+    FlightInfo endpoints point at the worker processes round-robin, so
+    DoGet (query execution and Arrow conversion) runs there, and actions
+    merge the workers' numbers. shared_cache makes the process take part
+    in cross-process cache invalidation over LISTEN/NOTIFY.
+
+    Kinds FLIGHT_ENGINE routes to the snapshot are answered in this process
+    (endpoints without a location) once the snapshot has loaded, and from
+    PostgreSQL until then. Workers are started with snapshot=False.
+    """
+
+    def __init__(
+        self,
+        host: str = "0.0.0.0",
+        port: int = FLIGHT_PORT,
+        worker_ports: list[int] | None = None,
+        shared_cache: bool = False,
+        snapshot: bool = True,
+    ):
         location = fl.Location.for_grpc_tcp(host, port)
-        super().__init__(location)
+        super().__init__(location, middleware={"compression": CompressionMiddlewareFactory()})
         self._location = location
+        self._cache = ResultCache(
+            FLIGHT_CACHE_MAX_MB * 1024 * 1024,
+            CACHE_TTL_S,
+            max_entry_bytes=FLIGHT_CACHE_ENTRY_MAX_MB * 1024 * 1024,
+        )
+        # request id -> list of server-side phase timings (plan + one per DoGet)
+        self._timings: OrderedDict[str, list[dict]] = OrderedDict()
+        self._timings_lock = threading.Lock()
+
+        worker_ports = worker_ports or []
+        self._workers = [fl.Location.for_grpc_tcp(FLIGHT_ADVERTISE_HOST, p) for p in worker_ports]
+        self._worker_clients = [fl.FlightClient(f"grpc://127.0.0.1:{p}") for p in worker_ports]
+        self._next_worker = itertools.count()
+        self._estimates = RowEstimates()
+        self._estimates.start()
+        self._snapshot = None
+        if snapshot and "snapshot" in ENGINES.values():
+            self._snapshot = TripSnapshot()
+            self._snapshot.start()
+        self._shared_cache = shared_cache
+        if shared_cache:
+            threading.Thread(target=listen_invalidations, args=(self._on_invalidation,), daemon=True).start()
+
+    def _on_invalidation(self, kinds: list[str] | None) -> None:
+        # None (e.g. after the listener reconnects): every kind the cache may hold
+        self._cache.invalidate(CACHE_TTL_S if kinds is None else kinds)
+        if self._snapshot is not None and kinds is not None:
+            self._snapshot.request_refresh()
+
+    def _from_snapshot(self, path: list[bytes]) -> bool:
+        return (
+            self._snapshot is not None
+            and self._snapshot.ready
+            and ENGINES.get(path[0].decode()) == "snapshot"
+        )
+
+    def _snapshot_stream(self, body: dict, request_id: str | None, options) -> fl.RecordBatchStream:
+        start = time.perf_counter()
+        kind, *args = body["path"]
+        try:
+            table = self._snapshot.query(kind, [int(a) for a in args])
+        except (ValueError, TypeError) as e:
+            raise fl.FlightServerError(f"Bad descriptor parameters: {e}")
+        self._record_timings(request_id, {
+            "phase": "get",
+            "cache_hit": False,
+            "engine": "snapshot",
+            "db_first_ms": 0.0,
+            "db_fetch_ms": 0.0,
+            "arrow_ms": (time.perf_counter() - start) * 1000.0,
+            "stream_ms": (time.perf_counter() - start) * 1000.0,
+            "rows": table.num_rows,
+        })
+        reader = pa.RecordBatchReader.from_batches(table.schema, table.to_batches(max_chunksize=STREAM_CHUNK_ROWS))
+        return fl.RecordBatchStream(reader, options=options)
+
+    def _endpoint_locations(self) -> list[fl.Location]:
+        """Where a ticket is redeemed: the next worker, or (no location) this server."""
+        if not self._workers:
+            return []
+        return [self._workers[next(self._next_worker) % len(self._workers)]]
+
+    def _worker_results(self, action_type: str, body: bytes = b"") -> list:
+        results = []
+        for client in self._worker_clients:
+            for r in client.do_action(fl.Action(action_type, body)):
+                results.append(json.loads(r.body.to_pybytes()))
+        return results
 
     def list_flights(self, context, criteria):
+        # Served from the static catalog and cached row estimates: no query runs here.
         for name in FLIGHTS:
+            schema, args = FLIGHT_CATALOG[name]
             descriptor = fl.FlightDescriptor.for_path(name.encode())
-            tbl = self._get_table_for_descriptor(descriptor)
+            # Kinds with required arguments cannot be fetched from the listing alone.
+            if args.startswith("/"):
+                endpoints = []
+            else:
+                ticket = self._make_ticket([name.encode()], uuid.uuid4().hex)
+                endpoints = [fl.FlightEndpoint(ticket, self._endpoint_locations())]
             yield fl.FlightInfo(
-                schema=tbl.schema,
+                schema=schema,
                 descriptor=descriptor,
-                endpoints=[fl.FlightEndpoint(name.encode(), [self._location])],
-                total_records=tbl.num_rows,
-                total_bytes=0,
+                endpoints=endpoints,
+                total_records=self._estimates.get(name),
+                total_bytes=-1,
+                app_metadata=json.dumps({"path": name + args, "estimated": True}).encode(),
             )
 
-    def _get_table_for_descriptor(self, descriptor: fl.FlightDescriptor) -> pa.Table:
+    def _query_for_path(self, path: list[bytes]) -> tuple[str, dict | None] | None:
+        """
+        Map a descriptor path to (sql, params) without touching the database.
+        Returns None for unknown kinds or bad parameters.
+        """
         try:
-            parts = [p.decode() for p in (descriptor.path or [])]
+            parts = [p.decode() for p in path]
             if not parts:
-                return pa.table({})
+                return None
 
             kind = parts[0]
 
             if kind == "trips_overview":
                 limit = int(parts[1]) if len(parts) > 1 else None
-                return fetch_trips_overview(limit)
+                return trips_overview_query(limit)
+
+            # Keyset pages: <kind>/[<user_id>/]<page_size>[/<position>], where the
+            # position is the key of the last row the client got from the
+            # previous page (see page_after); the page starts right after it.
+            if kind == "trips_overview_page":
+                if len(parts) < 2:
+                    print("trips_overview_page requires page_size")
+                    return None
+                size = int(parts[1])
+                return trips_overview_query(size, after=page_after(parts[2:]))
+
+            if kind == "user_history_page":
+                if len(parts) < 3:
+                    print("user_history_page requires user_id and page_size")
+                    return None
+                user_id = int(parts[1])
+                size = int(parts[2])
+                return user_history_query(
+                    user_id,
+                    size,
+                    after=page_after(parts[3:], USER_HISTORY_PAGE_KEYS),
+                    with_participant_id=True,
+                )
 
             if kind == "user_history":
                 if len(parts) < 2:
                     print("user_history requires user_id")
-                    return pa.table({})
+                    return None
                 user_id = int(parts[1])
                 limit = int(parts[2]) if len(parts) > 2 else None
-                return fetch_user_history(user_id, limit)
+                return user_history_query(user_id, limit)
 
             if kind == "company_stats":
                 if len(parts) < 2:
                     print("company_stats requires company_id")
-                    return pa.table({})
+                    return None
                 company_id = int(parts[1])
                 limit = int(parts[2]) if len(parts) > 2 else None
-                return fetch_company_daily_stats(company_id, limit)
+                return company_daily_stats_query(company_id, limit)
 
             if kind == "ids_vehicle":
                 limit = int(parts[1]) if len(parts) > 1 else 5000
-                return fetch_vehicle_ids(limit)
+                return vehicle_ids_query(limit)
 
             if kind == "ids_driver":
                 limit = int(parts[1]) if len(parts) > 1 else 5000
-                return fetch_driver_ids(limit)
+                return driver_ids_query(limit)
 
             if kind == "ids_user":
                 limit = int(parts[1]) if len(parts) > 1 else 5000
-                return fetch_user_ids(limit)
+                return user_ids_query(limit)
 
             if kind == "ids_location_home":
                 limit = int(parts[1]) if len(parts) > 1 else 5000
-                return fetch_location_ids("HOME", limit)
+                return location_ids_query("HOME", limit)
 
             if kind == "ids_location_office":
                 limit = int(parts[1]) if len(parts) > 1 else 5000
-                return fetch_location_ids("OFFICE", limit)
+                return location_ids_query("OFFICE", limit)
 
             if kind == "ids_location_pickup":
                 limit = int(parts[1]) if len(parts) > 1 else 5000
-                return fetch_location_ids("PICKUP_POINT", limit)
+                return location_ids_query("PICKUP_POINT", limit)
 
             if kind == "ids_trip":
                 limit = int(parts[1]) if len(parts) > 1 else 5000
-                return fetch_trip_ids(limit)
+                return trip_ids_query(limit)
+
+            if kind == "ids_all":
+                limit = int(parts[1]) if len(parts) > 1 else 5000
+                return ids_all_query(limit)
 
             print("Unknown query kind:", kind)
-            return pa.table({})
+            return None
 
-        except (ValueError, IndexError) as e:
+        except (ValueError, IndexError, UnicodeDecodeError) as e:
             print("Bad descriptor parameters:", e)
-            return pa.table({})
+            return None
+
+    @staticmethod
+    def _read_command(command: bytes) -> dict:
+        try:
+            cmd = json.loads(command)
+        except ValueError:
+            raise fl.FlightServerError(f"Invalid command: {command!r}")
+        if not isinstance(cmd, dict):
+            raise fl.FlightServerError("Invalid command: expected a JSON object")
+        return cmd
+
+    @staticmethod
+    def _query_for_command(cmd: dict) -> tuple[str, dict]:
+        """
+        Command descriptor: JSON {"kind": "trips", "columns", "where",
+        "start_from", "start_to", "order_by", "limit"}, all but kind
+        optional (see queries.trips_query). start_* are ISO 8601 times;
+        naive ones are taken as UTC. Invalid commands raise FlightServerError.
+        """
+        unknown = set(cmd) - {"kind", "columns", "where", "start_from", "start_to", "order_by", "limit"}
+        try:
+            if cmd.get("kind") != "trips":
+                raise ValueError(f"unknown kind {cmd.get('kind')!r}; commands support 'trips'")
+            if unknown:
+                raise ValueError(f"unknown keys: {', '.join(sorted(unknown))}")
+            bounds = {}
+            for key in ("start_from", "start_to"):
+                if cmd.get(key) is not None:
+                    at = datetime.datetime.fromisoformat(cmd[key])
+                    bounds[key] = at if at.tzinfo else at.replace(tzinfo=datetime.timezone.utc)
+            return trips_query(
+                columns=cmd.get("columns"),
+                where=cmd.get("where"),
+                order_by=cmd.get("order_by"),
+                limit=cmd.get("limit"),
+                **bounds,
+            )
+        except (ValueError, TypeError) as e:
+            raise fl.FlightServerError(f"Invalid trips command: {e}")
+
+    @staticmethod
+    def _cache_key(path: list[bytes], query: tuple[str, dict | None], data_version: str | None = None) -> tuple:
+        # Normalized form: the SQL and bound parameters the path resolved to,
+        # so "ids_user" and "ids_user/5000" share an entry. ids_all entries
+        # also carry the data_version they were planned under, so any write
+        # (even one not made through DoPut) leads to a fresh read.
+        sql, params = query
+        items = ((k, tuple(v) if isinstance(v, list) else v) for k, v in (params or {}).items())
+        return (path[0].decode(), sql, tuple(sorted(items)), data_version)
+
+    @staticmethod
+    def _output_schema(path: list[bytes], command: dict | None = None) -> pa.Schema | None:
+        """
+        Result schema of a descriptor: the catalog schema of its kind, with
+        narrowed integers and dictionary-encoded text, which results are
+        built with while the rows are converted. None if the kind has none.
+        """
+        if command is not None:
+            return trips_schema(command.get("columns"))
+        catalog = FLIGHT_CATALOG.get(path[0].decode())
+        return catalog[0] if catalog is not None else None
+
+    @staticmethod
+    def _make_ticket(
+        path: list[bytes],
+        request_id: str,
+        partition: dict | None = None,
+        codec: str | None = None,
+        engine: str | None = None,
+        command: dict | None = None,
+        data_version: str | None = None,
+    ) -> fl.Ticket:
+        """Tickets are opaque to clients; the server encodes what do_get needs to run the query."""
+        body = {"path": [p.decode() for p in path], "rid": request_id}
+        if partition is not None:
+            body["partition"] = partition
+        if codec is not None:
+            body["codec"] = codec
+        if engine is not None:
+            body["engine"] = engine
+        if command is not None:
+            body["cmd"] = command
+        if data_version is not None:
+            body["dv"] = data_version
+        return fl.Ticket(json.dumps(body).encode())
+
+    @staticmethod
+    def _requested_codec(context) -> str | None:
+        middleware = context.get_middleware("compression")
+        return middleware.codec if middleware is not None else None
+
+    @staticmethod
+    def _ipc_options(codec: str) -> pa.ipc.IpcWriteOptions:
+        return pa.ipc.IpcWriteOptions(compression=CODECS[codec])
+
+    def _record_timings(self, request_id: str | None, timings: dict) -> None:
+        if request_id is None:
+            return
+        with self._timings_lock:
+            self._timings.setdefault(request_id, []).append(timings)
+            self._timings.move_to_end(request_id)
+            while len(self._timings) > FLIGHT_TIMINGS_KEEP:
+                self._timings.popitem(last=False)
+
+    def _timed_stream(self, request_id: str | None, timings: dict, start: float, batches):
+        try:
+            yield from batches
+        finally:
+            timings["stream_ms"] = (time.perf_counter() - start) * 1000.0
+            self._record_timings(request_id, timings)
+
+    @staticmethod
+    def _read_ticket(ticket: fl.Ticket) -> dict:
+        try:
+            return json.loads(ticket.ticket)
+        except ValueError:
+            raise fl.FlightServerError(f"Invalid ticket: {ticket.ticket!r}")
+
+    def _plan_partitions(self, path: list[bytes]) -> list[dict] | None:
+        """
+        Split a large trips_overview into about FLIGHT_PARTITIONS keyset
+        ranges [boundary_i, boundary_i+1) of the (start_time DESC, id DESC)
+        order, one endpoint each. Rows written between planning and DoGet
+        move no row across ranges, so reading the endpoints in order and
+        concatenating gives the unpartitioned result. Only the last range of
+        a limited request has a LIMIT; the first of an unlimited one is open
+        at the top, the last one open at the bottom.
+        """
+        if FLIGHT_PARTITIONS < 2 or not path or path[0] != b"trips_overview":
+            return None
+        try:
+            limit = int(path[1]) if len(path) > 1 else None
+        except ValueError:
+            return None
+        if limit is not None and limit < FLIGHT_PARTITION_MIN_ROWS:
+            return None
+
+        # Unlimited: size by the planner's row estimate instead of a COUNT(*).
+        rows = limit if limit is not None else self._estimates.get("trips_overview")
+        if rows < FLIGHT_PARTITION_MIN_ROWS:
+            return None
+        size = -(-rows // FLIGHT_PARTITIONS)
+
+        try:
+            boundaries = trips_overview_boundaries(limit, size)
         except psycopg2.Error as e:
             print("DB error:", e)
-            return pa.table({})
-        except Exception as e:
-            print("Unexpected error:", e)
-            return pa.table({})
+            return None
+        if len(boundaries) < 2:
+            return None
+
+        keys = [[start_time.isoformat(), trip_id] for start_time, trip_id in boundaries]
+        partitions = []
+        for i, start_at in enumerate(keys):
+            last = i == len(keys) - 1
+            partitions.append({
+                "start_at": None if i == 0 and limit is None else start_at,
+                "end_at": None if last else keys[i + 1],
+                "limit": limit - i * size if last and limit is not None else None,
+            })
+        return partitions
+
+    @staticmethod
+    def _small_result(path: list[bytes], query: tuple[str, dict | None]) -> bool:
+        """
+        Small, bounded results run as prepared statements instead of on a
+        streaming cursor. Not trips commands: each client-chosen shape would
+        stay PREPAREd on every connection.
+        """
+        if path[0] == b"trips":
+            return False
+        if path[0] == b"company_stats":
+            return True
+        limit = (query[1] or {}).get("limit")
+        return limit is not None and limit <= FLIGHT_PREPARED_MAX_ROWS
+
+    @staticmethod
+    def _data_version() -> str | None:
+        try:
+            return ids_data_version()
+        except psycopg2.Error as e:
+            print("DB error:", e)
+            return None
+
+    def _query_for_ticket(self, body: dict) -> tuple[str, dict | None] | None:
+        if "cmd" in body:
+            return self._query_for_command(body["cmd"])
+        partition = body.get("partition")
+        if partition is None:
+            return self._query_for_path([p.encode() for p in body["path"]])
+
+        def key(value):
+            return None if value is None else (datetime.datetime.fromisoformat(value[0]), value[1])
+
+        return trips_overview_query(
+            partition["limit"],
+            start_at=key(partition["start_at"]),
+            end_at=key(partition["end_at"]),
+        )
 
     def get_flight_info(self, context, descriptor):
-        tbl = self._get_table_for_descriptor(descriptor)
-        ticket = fl.Ticket(b"|".join(descriptor.path or [b"unknown"]))
+        # Plan only: the query runs once, in do_get.
+        start = time.perf_counter()
+        request_id = uuid.uuid4().hex
+        command = None
+        if descriptor.descriptor_type == fl.DescriptorType.CMD:
+            # Structured trips query: projection, filters, order and limit pushed into SQL
+            command = self._read_command(descriptor.command)
+            path = [b"trips"]
+            query = self._query_for_command(command)
+        else:
+            path = list(descriptor.path or [b"unknown"])
+            query = self._query_for_path(path)
+        if query is not None and self._from_snapshot(path):
+            return self._snapshot_flight_info(context, descriptor, path, request_id, start)
+        data_version = self._data_version() if query is not None and path[0] == b"ids_all" else None
+        cached = self._cache.peek(self._cache_key(path, query, data_version)) if query else None
+
+        partitions = self._plan_partitions(path) if query is not None else None
+        # Every kind has a static result schema: nothing to ask PostgreSQL.
+        described = self._output_schema(path, command) if query is not None else pa.schema([])
+
+        if cached is not None and not partitions:
+            schema, total_records, total_bytes = cached.schema, cached.num_rows, cached.nbytes
+        else:
+            schema = cached.schema if cached is not None else described
+            total_records, total_bytes = -1, -1
+
+        app_metadata = {"request_id": request_id}
+        if data_version is not None:
+            app_metadata["data_version"] = data_version
+
+        # A codec requested here travels in the ticket, to whichever process redeems it.
+        codec = self._requested_codec(context)
+        tickets = [
+            self._make_ticket(path, request_id, p, codec, command=command, data_version=data_version)
+            for p in partitions or [None]
+        ]
+        self._record_timings(request_id, {
+            "phase": "plan",
+            "endpoints": len(tickets),
+            "plan_ms": (time.perf_counter() - start) * 1000.0,
+        })
         return fl.FlightInfo(
-            schema=tbl.schema,
+            schema=schema,
             descriptor=descriptor,
-            endpoints=[fl.FlightEndpoint(ticket, [self._location])],
-            total_records=tbl.num_rows,
-            total_bytes=0,
+            endpoints=[fl.FlightEndpoint(t, self._endpoint_locations()) for t in tickets],
+            total_records=total_records,
+            total_bytes=total_bytes,
+            ordered=bool(partitions),
+            app_metadata=json.dumps(app_metadata).encode(),
         )
 
-    def do_get(self, context, ticket):
-        parts = ticket.ticket.split(b"|")
-        descriptor = fl.FlightDescriptor.for_path(*parts)
-        tbl = self._get_table_for_descriptor(descriptor)
-        return fl.RecordBatchStream(tbl)
+    def _snapshot_flight_info(self, context, descriptor, path, request_id, start) -> fl.FlightInfo:
+        # One endpoint, redeemed here: the snapshot lives in this process only.
+        ticket = self._make_ticket(path, request_id, codec=self._requested_codec(context), engine="snapshot")
+        self._record_timings(request_id, {
+            "phase": "plan",
+            "endpoints": 1,
+            "engine": "snapshot",
+            "plan_ms": (time.perf_counter() - start) * 1000.0,
+        })
+        return fl.FlightInfo(
+            schema=FLIGHT_CATALOG[path[0].decode()][0],
+            descriptor=descriptor,
+            endpoints=[fl.FlightEndpoint(ticket, [])],
+            total_records=-1,
+            total_bytes=-1,
+            app_metadata=json.dumps({"request_id": request_id, "engine": "snapshot"}).encode(),
+        )
 
+    def do_get(self, context, ticket):
+        start = time.perf_counter()
+        body = self._read_ticket(ticket)
+        request_id = body.get("rid")
+        path = [p.encode() for p in body["path"]]
+        query = self._query_for_ticket(body)
+        if query is None:
+            return fl.RecordBatchStream(pa.table({}))
+        codec = self._requested_codec(context) or body.get("codec") or FLIGHT_COMPRESSION
+        if codec not in CODECS:
+            raise fl.FlightServerError(f"Unsupported compression {codec!r}")
+        options = self._ipc_options(codec)
+        if body.get("engine") == "snapshot" and self._snapshot is not None and self._snapshot.ready:
+            return self._snapshot_stream(body, request_id, options)
+
+        key = self._cache_key(path, query, body.get("dv"))
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._record_timings(request_id, {
+                "phase": "get",
+                "cache_hit": True,
+                "rows": cached.num_rows,
+                "bytes": cached.nbytes,
+                "codec": codec,
+            })
+            return fl.RecordBatchStream(cached, options=options)
+
+        timings = {"phase": "get", "cache_hit": False, "codec": codec}
+        schema = self._output_schema(path, body.get("cmd"))
+        # Before the query runs: a DoPut committing meanwhile must keep its result out of the cache.
+        generation = self._cache.generation(key[0])
+        try:
+            if self._small_result(path, query):
+                table = run_query(*query, timings=timings, schema=schema)
+                schema, batches = table.schema, iter(table.to_batches())
+            else:
+                schema, batches = stream_query(*query, timings=timings, schema=schema)
+        except psycopg2.Error as e:
+            print("DB error:", e)
+            return fl.RecordBatchStream(pa.table({}))
+        batches = self._cache.collect(key, key[0], schema, batches, generation)
+        # RecordBatchStream (unlike GeneratorStream) sends the dictionaries of
+        # dictionary-encoded columns; the reader still pulls batches lazily.
+        reader = pa.RecordBatchReader.from_batches(schema, self._timed_stream(request_id, timings, start, batches))
+        return fl.RecordBatchStream(reader, options=options)
+
+
+    def list_actions(self, context):
+        return [
+            ("pool_stats", "DB connection pool metrics (JSON)"),
+            ("cache_stats", "Result cache hit/miss/eviction counters (JSON)"),
+            ("statement_stats", "Prepared statement executions and plan cache hits (JSON)"),
+            ("timings", "Server-side phase timings for a FlightInfo request_id (JSON list)"),
+            ("export", "Stream a descriptor's result into a Parquet / Arrow IPC file on the server (JSON)"),
+        ]
+
+    def do_action(self, context, action):
+        if action.type == "pool_stats":
+            stats = pool_stats()
+            if self._worker_clients:
+                stats["workers"] = self._worker_results("pool_stats")
+            yield fl.Result(json.dumps(stats).encode())
+        elif action.type == "cache_stats":
+            stats = self._cache.stats()
+            if self._worker_clients:
+                stats["workers"] = self._worker_results("cache_stats")
+            yield fl.Result(json.dumps(stats).encode())
+        elif action.type == "statement_stats":
+            stats = statement_stats()
+            if self._worker_clients:
+                stats["workers"] = self._worker_results("statement_stats")
+            yield fl.Result(json.dumps(stats).encode())
+        elif action.type == "timings":
+            request_id = action.body.to_pybytes()
+            with self._timings_lock:
+                timings = list(self._timings.get(request_id.decode(), []))
+            for worker_timings in self._worker_results("timings", request_id):
+                timings.extend(worker_timings)
+            yield fl.Result(json.dumps(timings).encode())
+        elif action.type == "export":
+            yield fl.Result(json.dumps(self._export(self._read_command(action.body.to_pybytes()))).encode())
+        else:
+            raise fl.FlightServerError(f"Unknown action: {action.type}")
+
+    def _export(self, request: dict) -> dict:
+        """
+        Body: {"path": [...], "format": "parquet" | "arrow", "file",
+        "compression", "row_group_size", "use_dictionary"}; all but path
+        are optional. The query runs on a named cursor and every chunk goes
+        straight into the file, bypassing the result cache, so memory stays
+        at about one row group however large the result is.
+
+        Returns {"file", "format", "rows", "row_groups", "bytes", "ms"};
+        file is relative to FLIGHT_EXPORT_DIR. Invalid fields raise
+        FlightServerError before the query runs.
+        """
+        try:
+            parts = request.get("path")
+            if not isinstance(parts, list) or not parts or not all(isinstance(p, str) for p in parts):
+                raise ValueError(f"path must be a non-empty list of strings, got {parts!r}")
+            fmt = optional_str(request.get("format"), "format") or "parquet"
+            name = optional_str(request.get("file"), "file") or "_".join(parts) + (".parquet" if fmt == "parquet" else ".arrow")
+            compression = optional_str(request.get("compression"), "compression")
+            row_group_size = positive_int(request.get("row_group_size", EXPORT_ROW_GROUP_ROWS), "row_group_size")
+            use_dictionary = request.get("use_dictionary", True)
+            if not isinstance(use_dictionary, (bool, list)):
+                raise ValueError(f"use_dictionary must be a boolean or a list of columns, got {use_dictionary!r}")
+        except ValueError as e:
+            raise fl.FlightServerError(f"Invalid export request: {e}")
+
+        path = [p.encode() for p in parts]
+        query = self._query_for_path(path)
+        if query is None:
+            raise fl.FlightServerError(f"Unknown descriptor path: {parts}")
+        if os.path.basename(name) != name or name.startswith("."):
+            raise fl.FlightServerError(f"Invalid export file name: {name!r}")
+        os.makedirs(FLIGHT_EXPORT_DIR, exist_ok=True)
+
+        start = time.perf_counter()
+        schema, batches = stream_query(*query, schema=self._output_schema(path))
+        try:
+            writer = ExportWriter(
+                os.path.join(FLIGHT_EXPORT_DIR, name),
+                schema,
+                fmt=fmt,
+                compression=compression,
+                row_group_size=row_group_size,
+                use_dictionary=use_dictionary,
+            )
+        except ValueError as e:
+            batches.close()
+            raise fl.FlightServerError(str(e))
+        with writer:
+            for batch in batches:
+                writer.write_batch(batch)
+        result = {
+            "file": name,
+            "format": fmt,
+            "rows": writer.rows,
+            "row_groups": writer.row_groups,
+            "bytes": os.path.getsize(writer.path),
+            "ms": (time.perf_counter() - start) * 1000.0,
+        }
+        print(f"Export finished: {'/'.join(parts)} -> {name}, rows={writer.rows}, bytes={result['bytes']}")
+        return result
 
     def do_put(self, context, descriptor, reader, writer):
+        """
+        Path: <insert kind>[/batch]. By default the whole stream is one
+        transaction; with "batch" every record batch is committed on its own.
+
+        The declared schema is checked once, up front; batches are then
+        coerced to the target schema and invalid rows (nulls in required
+        columns, ids out of range, unknown status) are dropped, not inserted.
+
+        After each batch the server writes a JSON ack to the metadata
+        stream: {"batch", "rows", "rejected_rows", "errors", "received_rows",
+        "committed_rows"}, where errors lists {"row", "column", "error"} for
+        rejected rows (row = position in the stream, at most
+        FLIGHT_PUT_MAX_ERRORS per batch). A final {"done": true, ...} follows
+        once the stream has been committed.
+        """
         try:
             parts = [p.decode() for p in (descriptor.path or [])]
             if not parts:
                 raise ValueError("Missing descriptor path for DoPut")
 
             kind = parts[0]
-            total_inserted = 0
-
-            for chunk in reader:
-                batch = chunk.data
-                if batch is None:
-                    continue
-
-                tbl = pa.Table.from_batches([batch])
-                data = tbl.to_pydict()
-                n = tbl.num_rows
-
-                if kind == "insert_trip":
-                    required = [
-                        "vehicle_id", "driver_id", "company_id",
-                        "start_time", "end_time",
-                        "start_location_id", "end_location_id",
-                        "status"
-                    ]
-                    for col in required:
-                        if col not in data:
-                            raise ValueError(f"Missing column '{col}' for insert_trip")
-
-                    rows = [
-                        (
-                            data["vehicle_id"][i],
-                            data["driver_id"][i],
-                            data["company_id"][i],
-                            data["start_time"][i],
-                            data["end_time"][i],
-                            data["start_location_id"][i],
-                            data["end_location_id"][i],
-                            data["status"][i],
+            if kind not in PUT_TARGETS:
+                raise ValueError(f"Unknown DoPut endpoint: {kind}")
+            commit_each = len(parts) > 1 and parts[1] == "batch"
+            table, target, statuses = PUT_TARGETS[kind]
+            check_schema(reader.schema, target)
+            received = 0
+            inserted = 0
+            committed = 0
+            rejected = 0
+            batches = 0
+
+            # One pooled connection per stream; concurrent streams insert in parallel.
+            with connection() as conn:
+                with conn.cursor() as cur:
+                    for chunk in reader:
+                        batch = chunk.data
+                        if batch is None:
+                            continue
+
+                        batch = coerce_batch(batch, target)
+                        valid, n_rejected, errors = reject_rows(
+                            batch, statuses, first_row=received, max_errors=FLIGHT_PUT_MAX_ERRORS,
                         )
-                        for i in range(n)
-                    ]
-                    total_inserted += insert_trips_rows(rows)
-
-                elif kind == "insert_trip_participant":
-                    required = [
-                        "trip_id", "user_id",
-                        "pickup_location_id", "dropoff_location_id",
-                        "status"
-                    ]
-                    for col in required:
-                        if col not in data:
-                            raise ValueError(f"Missing column '{col}' for insert_trip_participant")
-
-                    rows = [
-                        (
-                            data["trip_id"][i],
-                            data["user_id"][i],
-                            data["pickup_location_id"][i],
-                            data["dropoff_location_id"][i],
-                            data["status"][i],
-                        )
-                        for i in range(n)
-                    ]
-                    total_inserted += insert_trip_participants_rows(rows)
-
-                else:
-                    raise ValueError(f"Unknown DoPut endpoint: {kind}")
-
-            print(f"DoPut finished: kind={kind}, inserted={total_inserted} rows")
+                        rows = copy_batch(cur, table, tuple(target.names), valid)
+                        received += batch.num_rows
+                        inserted += rows
+                        rejected += n_rejected
+                        batches += 1
+                        if commit_each:
+                            if self._shared_cache:
+                                notify_invalidation(cur, PUT_INVALIDATES[table])
+                            conn.commit()
+                            committed = inserted
+                            self._cache.invalidate(PUT_INVALIDATES[table])
+                        self._write_ack(writer, {
+                            "batch": batches - 1,
+                            "rows": rows,
+                            "rejected_rows": n_rejected,
+                            "errors": errors,
+                            "received_rows": received,
+                            "committed_rows": committed,
+                        })
+                    if self._shared_cache:
+                        notify_invalidation(cur, PUT_INVALIDATES[table])
+                conn.commit()
+            committed = inserted
+            self._cache.invalidate(PUT_INVALIDATES[table])
+            # With a shared cache the NOTIFY comes back through _on_invalidation.
+            if self._snapshot is not None and not self._shared_cache:
+                self._snapshot.request_refresh()
+            self._write_ack(writer, {
+                "done": True,
+                "batches": batches,
+                "received_rows": received,
+                "rejected_rows": rejected,
+                "committed_rows": committed,
+            })
+
+            print(f"DoPut finished: kind={kind}, inserted={committed} rows, rejected={rejected} rows")
 
         except Exception as e:
             print("DoPut error:", e)
             raise
 
+    def do_exchange(self, context, descriptor, reader, writer):
+        """
+        Path: user_history_batch[/<default_limit>]. The client streams
+        batches with an integer user_id column and an optional integer
+        limit column (null = default_limit, no default = full history).
+        Each input batch is answered by one set-based query, whose rows
+        (USER_HISTORY_BATCH_SCHEMA: user_history tagged with user_id) are
+        streamed back in input order.
+        """
+        parts = [p.decode() for p in (descriptor.path or [])]
+        if not parts or parts[0] != "user_history_batch":
+            raise ValueError(f"Unknown DoExchange endpoint: {'/'.join(parts) or '(empty)'}")
+        default_limit = int(parts[1]) if len(parts) > 1 else None
+
+        codec = self._requested_codec(context) or FLIGHT_COMPRESSION
+        writer.begin(USER_HISTORY_BATCH_SCHEMA, options=self._ipc_options(codec))
+
+        users = 0
+        rows = 0
+        for chunk in reader:
+            batch = chunk.data
+            if batch is None or batch.num_rows == 0:
+                continue
+            user_ids, limits = self._exchange_input(batch, default_limit)
+            _, batches = stream_query(*user_history_batch_query(user_ids, limits), schema=USER_HISTORY_BATCH_SCHEMA)
+            for out in batches:
+                writer.write_batch(out)
+                rows += out.num_rows
+            users += len(user_ids)
+
+        print(f"DoExchange finished: user_history_batch, users={users}, rows={rows}")
+
+    @staticmethod
+    def _exchange_input(batch: pa.RecordBatch, default_limit: int | None) -> tuple[list[int], list[int | None]]:
+        names = batch.schema.names
+        if "user_id" not in names or not pa.types.is_integer(batch.schema.field("user_id").type):
+            raise ValueError("user_history_batch input needs an integer 'user_id' column")
+        user_ids = batch.column("user_id")
+        if user_ids.null_count:
+            raise ValueError("user_history_batch input has null user_id values")
+
+        if "limit" in names:
+            if not pa.types.is_integer(batch.schema.field("limit").type):
+                raise ValueError("user_history_batch 'limit' column must be integer")
+            limits = batch.column("limit")
+            if default_limit is not None:
+                limits = pc.fill_null(limits, default_limit)
+        else:
+            limits = pa.repeat(default_limit, batch.num_rows) if default_limit is not None else None
+
+        if limits is not None and pc.any(pc.less(limits, 0)).as_py():
+            raise ValueError("user_history_batch limits must not be negative")
+        return (
+            user_ids.to_pylist(),
+            limits.to_pylist() if limits is not None else [None] * batch.num_rows,
+        )
+
+    @staticmethod
+    def _write_ack(writer, ack: dict) -> None:
+        writer.write(pa.py_buffer(json.dumps(ack).encode()))
 
-def run_server():
-    server = CommuteFlightServer()
-    print(f"Starting Flight server on grpc://0.0.0.0:{FLIGHT_PORT}")
+
+def _serve_worker(port: int) -> None:
+    server = CommuteFlightServer(port=port, shared_cache=True, snapshot=False)
+    print(f"Worker {os.getpid()} serving on grpc://0.0.0.0:{port}")
     server.serve()
 
 
+def _supervise(workers: dict[int, multiprocessing.Process], ctx, stop: threading.Event) -> None:
+    """Restart worker processes that die."""
+    while not stop.wait(1.0):
+        for port, proc in list(workers.items()):
+            if not proc.is_alive() and not stop.is_set():
+                print(f"Worker on port {port} exited with {proc.exitcode}; restarting")
+                workers[port] = ctx.Process(target=_serve_worker, args=(port,))
+                workers[port].start()
+
+
+def _exit_on_signal(signum, frame):
+    raise SystemExit(0)
+
+
+def run_server():
+    if FLIGHT_WORKERS <= 1:
+        server = CommuteFlightServer()
+        print(f"Starting Flight server on grpc://0.0.0.0:{FLIGHT_PORT}")
+        server.serve()
+        return
+
+    # Arrow Flight servers cannot share a port (no SO_REUSEPORT), so the
+    # coordinator on FLIGHT_PORT hands out endpoints on the worker ports.
+    # Each worker is its own process with its own GIL, pool and cache.
+    ctx = multiprocessing.get_context("spawn")
+    ports = [FLIGHT_PORT + 1 + i for i in range(FLIGHT_WORKERS)]
+    workers = {port: ctx.Process(target=_serve_worker, args=(port,)) for port in ports}
+    for proc in workers.values():
+        proc.start()
+
+    stop = threading.Event()
+    threading.Thread(target=_supervise, args=(workers, ctx, stop), daemon=True).start()
+    signal.signal(signal.SIGTERM, _exit_on_signal)
+
+    try:
+        server = CommuteFlightServer(worker_ports=ports, shared_cache=True)
+        print(
+            f"Starting Flight server on grpc://0.0.0.0:{FLIGHT_PORT} with {FLIGHT_WORKERS} workers "
+            f"on ports {ports[0]}-{ports[-1]} (advertised as {FLIGHT_ADVERTISE_HOST})"
+        )
+        server.serve()
+    finally:
+        stop.set()
+        for proc in workers.values():
+            proc.terminate()
+        for proc in workers.values():
+            proc.join()
+
+
 if __name__ == "__main__":
     run_server()
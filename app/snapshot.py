@@ -0,0 +1,320 @@
+import os
+import threading
+import time
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import psycopg2
+
+from catalog import COMPANY_STATS_SCHEMA, TRIPS_OVERVIEW_SCHEMA, USER_HISTORY_SCHEMA
+from queries import rewrites_version, stream_query
+
+# Full reload interval; between reloads the snapshot is kept up to date by refresh()
+SNAPSHOT_RELOAD_S = float(os.environ.get("FLIGHT_SNAPSHOT_RELOAD_S", "600"))
+# How often to check for updates / deletes (which only a full reload picks up)
+SNAPSHOT_POLL_S = float(os.environ.get("FLIGHT_SNAPSHOT_POLL_S", "10"))
+
+# Kinds the snapshot can answer (see FLIGHT_ENGINE in server.py)
+SNAPSHOT_KINDS = ("trips_overview", "user_history", "company_stats")
+
+# Low-cardinality text columns, kept dictionary-encoded in memory
+DICTIONARY_COLUMNS = ("status", "vehicle_type", "start_city", "end_city")
+
+# Trips with everything trips_overview, user_history and company_stats need.
+# day is computed by PostgreSQL so it matches the company_daily_stats rollup.
+SNAPSHOT_TRIPS_SQL = """
+    SELECT
+        t.id AS trip_id,
+        t.company_id,
+        t.driver_id,
+        t.status,
+        t.start_time,
+        t.end_time,
+        date_trunc('day', t.start_time) AS day,
+        d.name AS driver_name,
+        d.surname AS driver_surname,
+        v.id AS vehicle_id,
+        vt.type AS vehicle_type,
+        vt.capacity AS vehicle_capacity,
+        sl.city AS start_city,
+        sl.street AS start_street,
+        el.city AS end_city,
+        el.street AS end_street
+    FROM trip t
+    JOIN "user" d ON t.driver_id = d.id
+    JOIN vehicle v ON t.vehicle_id = v.id
+    JOIN vehicle_type vt ON v.vehicle_type_id = vt.id
+    JOIN location sl ON t.start_location_id = sl.id
+    JOIN location el ON t.end_location_id = el.id
+    WHERE t.id > %(after)s
+"""
+
+SNAPSHOT_PARTICIPANTS_SQL = """
+    SELECT id, trip_id, user_id, status
+    FROM trip_participant
+    WHERE id > %(after)s
+"""
+
+PARTICIPANTS_SCHEMA = pa.schema([
+    ("trip_id", pa.int32()),
+    ("user_id", pa.int32()),
+    ("status", pa.dictionary(pa.int32(), pa.string())),
+])
+
+OVERVIEW_ORDER = [("start_time", "descending"), ("trip_id", "descending")]
+
+
+def _load(sql: str, after: int, id_column: str) -> tuple[pa.Table, int]:
+    """Rows with id > after as a table with DICTIONARY_COLUMNS encoded, plus the highest id seen."""
+    schema, batches = stream_query(sql, {"after": after})
+    table = pa.Table.from_batches(list(batches), schema=schema)
+    for name in DICTIONARY_COLUMNS:
+        if name in table.column_names:
+            i = table.column_names.index(name)
+            table = table.set_column(i, name, pc.dictionary_encode(table.column(name)))
+    last = pc.max(table.column(id_column)).as_py()
+    return table.combine_chunks(), max(after, last or 0)
+
+
+def _grown(values: np.ndarray, size: int, fill: int) -> np.ndarray:
+    if len(values) >= size:
+        return values
+    grown = np.full(size, fill, dtype=values.dtype)
+    grown[:len(values)] = values
+    return grown
+
+
+def _merge_order(trips: pa.Table, new_trips: pa.Table) -> np.ndarray:
+    """
+    take() indices into concat(trips, new_trips) that merge the sorted new
+    rows into the sorted trips (OVERVIEW_ORDER), without sorting again.
+    """
+    # Ascending keys for searchsorted: negated start_time, then negated id.
+    times = -trips.column("start_time").cast(pa.int64()).to_numpy()
+    new_times = -new_trips.column("start_time").cast(pa.int64()).to_numpy()
+    ids = trips.column("trip_id").to_numpy()
+    new_ids = new_trips.column("trip_id").to_numpy()
+
+    at = np.searchsorted(times, new_times, side="left")
+    ties_end = np.searchsorted(times, new_times, side="right")
+    # Among trips with the same start_time, the new row goes after the higher ids.
+    for k in np.nonzero(ties_end > at)[0]:
+        at[k] += int(np.count_nonzero(ids[at[k]:ties_end[k]] > new_ids[k]))
+
+    n, m = len(times), len(new_times)
+    order = np.empty(n + m, dtype=np.int64)
+    new_positions = at + np.arange(m)
+    is_new = np.zeros(n + m, dtype=bool)
+    is_new[new_positions] = True
+    order[new_positions] = n + np.arange(m)
+    order[~is_new] = np.arange(n)
+    return order
+
+
+class TripSnapshot:
+    """
+    Columnar in-memory copy of trip (joined with its driver, vehicle and
+    locations) and trip_participant, answering trips_overview,
+    user_history and company_stats with pyarrow.compute instead of
+    PostgreSQL.
+
+    Trips are kept sorted in trips_overview order (start_time DESC, id
+    DESC), so a trips_overview limit is a slice; user_history filters the
+    participants and takes the matching trip rows; company_stats is a
+    filter plus a group-by on the trigger-equivalent day column.
+    passenger_count is maintained per trip id from the participants.
+
+    load() (re)reads everything, on start() and then every reload_s
+    seconds; refresh() merges in rows with ids above the last ones seen.
+    After DoPut commits, request_refresh() has the background thread run
+    one refresh for all requests made meanwhile. Rows committed out of id
+    order by concurrent writers are picked up by the next full reload.
+
+    Updates and deletes (e.g. plain SQL outside DoPut) cannot be appended:
+    when the rewrite counters of rollups.sql (queries.rewrites_version)
+    moved since the last load, refresh() and a check every poll_s seconds
+    run a full load() instead. Until then, and without those counters
+    until the next periodic reload, the snapshot serves the old rows.
+    """
+
+    def __init__(self, reload_s: float = SNAPSHOT_RELOAD_S, poll_s: float = SNAPSHOT_POLL_S):
+        self.reload_s = reload_s
+        self.poll_s = poll_s
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        # (trips, participants, row of each trip id or -1), replaced as a whole
+        self._state: tuple[pa.Table, pa.Table, np.ndarray] | None = None
+        self._last_trip_id = 0
+        self._last_participant_id = 0
+        self._passengers = np.zeros(0, dtype=np.int64)
+        # rewrites_version() as of the last load (None: counters unavailable)
+        self._rewrites = None
+
+    @property
+    def ready(self) -> bool:
+        return self._state is not None
+
+    def start(self) -> None:
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+
+    def request_refresh(self) -> None:
+        """Ask the background thread for a refresh; returns at once, requests made meanwhile coalesce."""
+        self._wake.set()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.load()
+            except psycopg2.Error as e:
+                print("Snapshot load failed:", e)
+            reload_at = time.monotonic() + self.reload_s
+            while True:
+                timeout = min(self.poll_s, reload_at - time.monotonic())
+                if timeout <= 0:
+                    break
+                woken = self._wake.wait(timeout)
+                if self._stop.is_set():
+                    return
+                self._wake.clear()
+                try:
+                    if woken:
+                        self.refresh()
+                    elif self._rewritten():
+                        self.load()
+                except psycopg2.Error as e:
+                    print("Snapshot refresh failed:", e)
+
+    def _rewritten(self) -> bool:
+        """Updates / deletes since the last load, per the rollups.sql counters."""
+        try:
+            return self._rewrites is not None and rewrites_version() != self._rewrites
+        except psycopg2.Error:
+            return False
+
+    def load(self) -> None:
+        start = time.perf_counter()
+        with self._refresh_lock:
+            # Read before the rows: writes made during the load trigger another one.
+            try:
+                rewrites = rewrites_version()
+            except psycopg2.Error as e:
+                print("Snapshot rewrite counters unavailable (run rollups.sql):", e)
+                rewrites = None
+            self._update(None, 0, 0, np.zeros(0, dtype=np.int64))
+            self._rewrites = rewrites
+        trips, participants, _ = self._state
+        print(
+            f"Snapshot loaded: {trips.num_rows} trips, {participants.num_rows} participants, "
+            f"{(trips.nbytes + participants.nbytes) / (1024 * 1024):.0f} MB "
+            f"in {(time.perf_counter() - start) * 1000.0:.0f} ms"
+        )
+
+    def refresh(self) -> None:
+        """
+        Pick up rows inserted since the last load / refresh, or reload
+        everything after updates / deletes (no-op before the first load).
+        """
+        if self._state is None:
+            return
+        if self._rewritten():
+            self.load()
+            return
+        with self._refresh_lock:
+            self._update(self._state, self._last_trip_id, self._last_participant_id, self._passengers)
+
+    def _update(self, state, last_trip_id: int, last_participant_id: int, passengers: np.ndarray) -> None:
+        new_trips, last_trip_id = _load(SNAPSHOT_TRIPS_SQL, last_trip_id, "trip_id")
+        new_participants, last_participant_id = _load(SNAPSHOT_PARTICIPANTS_SQL, last_participant_id, "id")
+        if state is not None and new_trips.num_rows == 0 and new_participants.num_rows == 0:
+            return
+
+        new_participants = new_participants.select(PARTICIPANTS_SCHEMA.names).cast(PARTICIPANTS_SCHEMA)
+        if state is None:
+            trips, participants = new_trips, new_participants
+        else:
+            trips, participants, _ = state
+            trips = trips.drop_columns(["passenger_count"])
+            participants = pa.concat_tables([participants, new_participants]).combine_chunks()
+
+        if new_participants.num_rows:
+            trip_ids = new_participants.column("trip_id").to_numpy()
+            passengers = _grown(passengers, int(trip_ids.max()) + 1, 0)
+            passengers = passengers + np.bincount(trip_ids, minlength=len(passengers))
+
+        if new_trips.num_rows:
+            new_trips = new_trips.take(pc.sort_indices(new_trips, sort_keys=OVERVIEW_ORDER))
+            if state is None:
+                trips = new_trips.combine_chunks()
+            else:
+                order = _merge_order(trips, new_trips)
+                trips = pa.concat_tables([trips, new_trips]).take(order).combine_chunks()
+        trip_ids = trips.column("trip_id").to_numpy()
+        size = int(trip_ids.max()) + 1 if len(trip_ids) else 0
+        passengers = _grown(passengers, size, 0)
+        trips = trips.append_column("passenger_count", pa.array(passengers[trip_ids]))
+        positions = np.full(size, -1, dtype=np.int64)
+        positions[trip_ids] = np.arange(len(trip_ids))
+
+        self._state = (trips, participants, positions)
+        self._last_trip_id = last_trip_id
+        self._last_participant_id = last_participant_id
+        self._passengers = passengers
+
+    def query(self, kind: str, args: list[int]) -> pa.Table:
+        """Answer a descriptor kind with its path arguments, e.g. ("user_history", [1, 500])."""
+        handlers = {
+            "trips_overview": self.trips_overview,
+            "user_history": self.user_history,
+            "company_stats": self.company_stats,
+        }
+        return handlers[kind](*args)
+
+    def trips_overview(self, limit: int | None = None) -> pa.Table:
+        trips = self._state[0]
+        if limit is not None:
+            trips = trips.slice(0, limit)
+        return trips.select(TRIPS_OVERVIEW_SCHEMA.names).cast(TRIPS_OVERVIEW_SCHEMA)
+
+    def user_history(self, user_id: int, limit: int | None = None) -> pa.Table:
+        trips, participants, positions = self._state
+        mine = pc.equal(participants.column("user_id"), user_id)
+        trip_ids = participants.column("trip_id").filter(mine).to_numpy()
+        # Trips not in the snapshot yet (participants refreshed first) are skipped.
+        rows = positions[trip_ids[trip_ids < len(positions)]]
+        rows = np.sort(rows[rows >= 0])
+        if limit is not None:
+            rows = rows[:limit]
+        history = trips.take(rows)
+        history = history.append_column("is_driver", pc.equal(history.column("driver_id"), user_id))
+        return history.select(USER_HISTORY_SCHEMA.names).cast(USER_HISTORY_SCHEMA)
+
+    def company_stats(self, company_id: int, limit: int | None = None) -> pa.Table:
+        trips = self._state[0]
+        mine = trips.filter(pc.equal(trips.column("company_id"), company_id))
+        passengers = mine.column("passenger_count")
+        days = pa.table({
+            "day": mine.column("day"),
+            "passengers": passengers,
+            "with_passengers": pc.cast(pc.greater(passengers, 0), pa.int64()),
+        }).group_by("day").aggregate([
+            ([], "count_all"),
+            ("passengers", "sum"),
+            ("with_passengers", "sum"),
+        ])
+        # Same as the rollup: passenger_sum / trips_with_passengers, null without passengers.
+        with_passengers = days.column("with_passengers_sum")
+        avg = pc.divide(
+            pc.cast(days.column("passengers_sum"), pa.float64()),
+            pc.if_else(pc.equal(with_passengers, 0), pa.scalar(None, pa.float64()), pc.cast(with_passengers, pa.float64())),
+        )
+        stats = pa.table({"day": days.column("day"), "trips": days.column("count_all"), "avg_passengers": avg})
+        stats = stats.take(pc.sort_indices(stats, sort_keys=[("day", "descending")]))
+        if limit is not None:
+            stats = stats.slice(0, limit)
+        return stats.cast(COMPANY_STATS_SCHEMA)
@@ -0,0 +1,151 @@
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Arrow schemas DoPut batches are coerced to before COPY. Non-nullable
+# fields mirror the NOT NULL columns of db-init.sql; ids are INT there.
+TS = pa.timestamp("us", tz="UTC")
+
+TRIP_SCHEMA = pa.schema([
+    pa.field("vehicle_id", pa.int64(), nullable=False),
+    pa.field("driver_id", pa.int64(), nullable=False),
+    pa.field("company_id", pa.int64(), nullable=False),
+    pa.field("start_time", TS, nullable=False),
+    pa.field("end_time", TS),
+    pa.field("start_location_id", pa.int64(), nullable=False),
+    pa.field("end_location_id", pa.int64(), nullable=False),
+    pa.field("status", pa.string(), nullable=False),
+])
+
+TRIP_PARTICIPANT_SCHEMA = pa.schema([
+    pa.field("trip_id", pa.int64(), nullable=False),
+    pa.field("user_id", pa.int64(), nullable=False),
+    pa.field("pickup_location_id", pa.int64(), nullable=False),
+    pa.field("dropoff_location_id", pa.int64(), nullable=False),
+    pa.field("status", pa.string(), nullable=False),
+])
+
+TRIP_STATUSES = ("PLANNED", "IN_PROGRESS", "COMPLETED", "CANCELLED")
+TRIP_PARTICIPANT_STATUSES = ("JOINED", "CANCELLED", "NO_SHOW")
+
+INT4_MAX = 2**31 - 1
+
+
+def positive_int(value, name: str) -> int:
+    """
+    A request field as a positive int. Integral strings are accepted; other
+    types (including bools and floats) raise ValueError naming the field.
+    """
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(f"{name} must be a positive integer, got {value!r}")
+    try:
+        number = int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a positive integer, got {value!r}") from None
+    if number < 1:
+        raise ValueError(f"{name} must be a positive integer, got {value!r}")
+    return number
+
+
+def optional_str(value, name: str) -> str | None:
+    """A request field that is either absent (None) or a string; raises ValueError otherwise."""
+    if value is not None and not isinstance(value, str):
+        raise ValueError(f"{name} must be a string, got {value!r}")
+    return value
+
+
+def _is_text(t: pa.DataType) -> bool:
+    if pa.types.is_dictionary(t):
+        t = t.value_type
+    return pa.types.is_string(t) or pa.types.is_large_string(t)
+
+
+def _compatible(src: pa.DataType, dst: pa.DataType) -> bool:
+    """Lossless-in-kind coercions only (no parsing strings into numbers etc.)."""
+    if pa.types.is_integer(dst):
+        return pa.types.is_integer(src)
+    if pa.types.is_timestamp(dst):
+        return pa.types.is_timestamp(src) or pa.types.is_date(src)
+    if pa.types.is_string(dst):
+        return _is_text(src)
+    return src.equals(dst)
+
+
+def check_schema(declared: pa.Schema, target: pa.Schema) -> None:
+    """
+    Validate a DoPut stream's declared schema once, before any batch is
+    read. Raises ValueError listing every missing or incompatible column.
+    Extra columns are ignored.
+    """
+    problems = []
+    for field in target:
+        idx = declared.get_field_index(field.name)
+        if idx < 0:
+            problems.append(f"missing column '{field.name}'")
+        elif not _compatible(declared.field(idx).type, field.type):
+            problems.append(f"column '{field.name}' is {declared.field(idx).type}, expected {field.type}")
+    if problems:
+        raise ValueError("Schema mismatch: " + "; ".join(problems))
+
+
+def coerce_batch(batch: pa.RecordBatch, target: pa.Schema) -> pa.RecordBatch:
+    """
+    Select the target columns and cast them with Arrow kernels: integer
+    widening, timestamp unit (truncating sub-microseconds) and time zone
+    (naive timestamps are taken as UTC), dictionary/large strings to string.
+    """
+    columns = []
+    for field in target:
+        col = batch.column(field.name)
+        if not col.type.equals(field.type):
+            if pa.types.is_timestamp(field.type) and pa.types.is_timestamp(col.type) and col.type.tz is None:
+                col = pc.assume_timezone(col, "UTC")
+            col = pc.cast(col, options=pc.CastOptions(field.type, allow_time_truncate=True))
+        columns.append(col)
+    return pa.RecordBatch.from_arrays(columns, schema=target)
+
+
+def reject_rows(
+    batch: pa.RecordBatch,
+    statuses: tuple[str, ...],
+    first_row: int = 0,
+    max_errors: int = 100,
+) -> tuple[pa.RecordBatch, int, list[dict]]:
+    """
+    Drop rows that would fail in the database: nulls in NOT NULL columns,
+    ids outside INT range, status values outside `statuses`. Checks run as
+    vectorized masks; only offending row numbers reach Python.
+
+    Returns (valid rows, number of rejected rows, errors). Each error is
+    {"row", "column", "error"}, with row = first_row + index in the batch,
+    capped at max_errors per batch.
+    """
+    checks = []
+    for field in batch.schema:
+        col = batch.column(field.name)
+        if not field.nullable and col.null_count:
+            checks.append((field.name, "null", pc.is_null(col)))
+        if pa.types.is_integer(field.type):
+            checks.append((field.name, "out of range", pc.fill_null(
+                pc.or_(pc.less(col, 1), pc.greater(col, INT4_MAX)), False)))
+    if "status" in batch.schema.names:
+        status = batch.column("status")
+        bad = pc.invert(pc.is_in(status, value_set=pa.array(statuses)))
+        checks.append(("status", f"not one of {', '.join(statuses)}", pc.and_(bad, pc.is_valid(status))))
+
+    rejected = pa.repeat(False, batch.num_rows)
+    errors = []
+    for column, error, mask in checks:
+        if not pc.any(mask).as_py():
+            continue
+        rejected = pc.or_(rejected, mask)
+        if len(errors) < max_errors:
+            rows = pc.indices_nonzero(mask).slice(0, max_errors - len(errors))
+            errors.extend(
+                {"row": first_row + i, "column": column, "error": error}
+                for i in rows.to_pylist()
+            )
+
+    n_rejected = pc.sum(rejected).as_py() or 0
+    if n_rejected == 0:
+        return batch, 0, errors
+    return batch.filter(pc.invert(rejected)), n_rejected, errors